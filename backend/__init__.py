@@ -8,6 +8,7 @@ from .routes import (
     labeling_functions_router,
     battle_router
 )
+from .worker import manager
 
 dataset_router.include_router(
     label_router, prefix="/{dataset_id}/labels", tags=["Labels"]
@@ -28,3 +29,8 @@ app.include_router(dataset_router, prefix="/datasets", tags=["Datasets"])
 app.include_router(user_router, prefix="/users", tags=["Users & Auth"])
 
 app.include_router(sample_router, prefix="/samples", tags=["Samples"])
+
+
+@app.on_event("startup")
+async def start_worker_supervision():
+    manager.start_supervision()
@@ -2,8 +2,8 @@ import uvicorn
 
 from .importing import import_test_datasets
 from .config import Base, engine, db, logger
-from .models import User, Sample
-from .utils import get_password_hash
+from .models import User
+from .utils import get_password_hash, FeatureStore, migrate_image_contents
 
 
 def create_dummy_users():
@@ -38,15 +38,13 @@ def create_dummy_users():
 
 if __name__ == "__main__":
     Base.metadata.create_all(bind=engine)
+    FeatureStore.migrate_dataset_features()
+    migrate_image_contents()
 
     if not db.query(User).count():
         create_dummy_users()
         db.commit()
 
-    if not db.query(Sample).count():
-        import_test_datasets()
-        db.commit()
-
     import_test_datasets()
     db.commit()
 
@@ -14,13 +14,15 @@ from ..models import (
     Metric,
     MetricsDFKeys,
     DataMapsDTO,
-    Dataset,
     Sample,
     ClassificationBoundariesDTO,
     VectorSpaceDTO,
     MetricScoresIteration,
     MetricIteration)
-from ..utils import zip_unequal
+from ..utils import zip_unequal, FeatureStore, first_label_per_sample
+
+# the data map of an iteration uses the predictions of this many preceding iterations (and the iteration itself)
+DATA_MAP_WINDOW = 10
 
 
 class BattleAnalyzer:
@@ -62,39 +64,59 @@ class BattleAnalyzer:
     def get_confidence_his_data(self) -> Tuple[List[List[float]], List[List[float]]]:
 
         def gen(experiment_idx: int):
-            data_over_iterations = []
-            for _, row in self.results[experiment_idx].raw_predictions.iterrows():
-                data_over_iterations.append(list(row.map(lambda cell: max(cell))))
-            return data_over_iterations
+            # highest confidence per iteration and test sample
+            return self.results[experiment_idx].raw_predictions.max(axis=2).tolist()
 
         return gen(0), gen(1)
 
     def get_data_map_data(self) -> Tuple[List[pd.DataFrame], List[pd.DataFrame]]:
-
-        def for_each_iteration(iteration: int, raw_predictions: pd.DataFrame, correct_label_as_idx):
-            # use the last 10 iterations as input
-            first_iteration = max(0, iteration - 10)
-            # include current iteration
-            reduced_frame = raw_predictions.iloc[first_iteration:(iteration + 1), :]
-            data = []
-            for smpl in reduced_frame.columns:
-                confidence = reduced_frame[smpl].map(lambda x: max(x)).mean()
-                variance = reduced_frame[smpl].map(lambda x: x.index(max(x))).var()
-                variance = 0.0 if np.isnan(variance) else variance  # if only one iteration var() returns nan
-                correctness = reduced_frame[smpl].map(lambda x: x.index(max(x)) == correct_label_as_idx[smpl]).mean()
-                data.append({'Confidence': confidence,
-                             'Variability': variance,
-                             'Correctness': correctness,
-                             'SampleID': smpl})
-            return pd.DataFrame(data)
+        """ @return for each experiment for each iteration a data-frame with columns:
+                Confidence, Variability, Correctness, SampleID (over the last DATA_MAP_WINDOW iterations)"""
+        if self.data_maps is not None:
+            return self.data_maps
 
         def gen(exp_idx: int) -> List[pd.DataFrame]:
             r = self.results[exp_idx]
-            raw_predictions: pd.DataFrame = r.raw_predictions
-            return [for_each_iteration(iteration, raw_predictions, r.correct_label_as_idx)
-                    for iteration in raw_predictions.index]
+            sample_ids = r.test_sample_ids
+            predictions = r.raw_predictions
+            confidence, variability, correctness = BattleAnalyzer._data_map_scores(predictions, r.correct_class_idx())
+            return [pd.DataFrame({'Confidence': confidence[iteration],
+                                  'Variability': variability[iteration],
+                                  'Correctness': correctness[iteration],
+                                  'SampleID': sample_ids})
+                    for iteration in range(len(predictions))]
+
+        self.data_maps = gen(0), gen(1)
+        return self.data_maps
 
-        return gen(0), gen(1)
+    @staticmethod
+    def _data_map_scores(predictions: np.ndarray, correct_idx: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Mean confidence, variance of the predicted class and share of correct predictions per iteration and sample.
+
+        Every iteration uses a window of the last DATA_MAP_WINDOW iterations (and itself). The window sums are
+        differences of cumulative sums, so all iterations are computed at once.
+        @param predictions: iteration x sample x class
+        @param correct_idx: index of the correct class per sample
+        """
+        iterations = len(predictions)
+        confidence = predictions.max(axis=2).astype(np.float64)
+        predicted_class = predictions.argmax(axis=2).astype(np.float64)
+        correct = (predicted_class == correct_idx[np.newaxis, :]).astype(np.float64)
+
+        ends = np.arange(1, iterations + 1)
+        starts = np.maximum(0, ends - 1 - DATA_MAP_WINDOW)
+        window_size = (ends - starts)[:, np.newaxis]
+
+        def window_sum(values: np.ndarray) -> np.ndarray:
+            cumulated = np.concatenate([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+            return cumulated[ends] - cumulated[starts]
+
+        class_sum = window_sum(predicted_class)
+        # sample variance (ddof=1) as pandas computes it, 0.0 for a window of one iteration
+        squared_deviations = np.maximum(window_sum(predicted_class ** 2) - class_sum ** 2 / window_size, 0.0)
+        variability = np.where(window_size > 1, squared_deviations / np.maximum(window_size - 1, 1), 0.0)
+        return window_sum(confidence) / window_size, variability, window_sum(correct) / window_size
 
     def get_data_map_description(self, base_url: str) -> DataMapsDTO:
         data = self.get_data_map_data()
@@ -103,20 +125,13 @@ class BattleAnalyzer:
                            exp_two_iterations=descriptions[1])
 
     def _use_pca_for_feature_selection(self, exclude: List[int]):
-        dataset = db.get(Dataset, self.dataset_id)
-        feature_names = dataset.feature_names
-        samples = [s for s in
-                   db.query(Sample).filter(Sample.dataset_id == self.dataset_id).filter(Sample.id.not_in(exclude)).all()
-                   if s.labels != []]
-
-        samples_df = pd.DataFrame([
-            [smpl.id] + smpl.extract_feature_list()
-            for smpl in samples],
-            columns=["SampleID"] + feature_names.split(","))
+        excluded = set(exclude)
+        labeled_ids = [sample_id for sample_id in sorted(first_label_per_sample(self.dataset_id).keys())
+                       if sample_id not in excluded]
         pca = PCA(n_components=2)
-        transformed_samples = pca.fit_transform(X=samples_df.iloc[:, 1:])
+        transformed_samples = pca.fit_transform(X=FeatureStore.load(self.dataset_id).features_of(labeled_ids))
         pca_df = pd.DataFrame(data=transformed_samples, columns=["PCA1", "PCA2"])
-        pca_df["SampleID"] = samples_df["SampleID"]
+        pca_df["SampleID"] = labeled_ids
         pca_df.set_index("SampleID")
         return pca_df
 
@@ -144,7 +159,7 @@ class BattleAnalyzer:
         def gen(exp_idx: int):
             r = self.results[exp_idx]
             # reduced_features_df['SampleID'] == all training sample
-            test_sample = list(map(lambda id_: int(id_), r.raw_predictions.columns))
+            test_sample = list(r.test_sample_ids)
             reduced_features_df = self._use_pca_for_feature_selection(exclude=test_sample) \
                 if self.config.PLOT_CONFIG.FEATURES is None \
                 else self._use_names_for_feature_selection(*self.config.PLOT_CONFIG.FEATURES, exclude=test_sample)
@@ -189,20 +204,20 @@ class BattleAnalyzer:
         else:
             reduced_features = self.cb_sample.loc[:, self.config.PLOT_CONFIG.FEATURES]
 
-        def for_each_iteration(iteration: pd.Series, classes: List[str]):
+        def for_each_iteration(predicted_class: np.ndarray, confidence: np.ndarray):
             iter_pf = pd.DataFrame(data={
-                'Class': [classes[confidence_scores.index(max(confidence_scores))] for _, confidence_scores in
-                          iteration.iteritems()],
-                'Confidence': [max(item) for _, item in iteration.iteritems()]
+                'Class': predicted_class,
+                'Confidence': confidence
             })
             return pd.merge(reduced_features, iter_pf, left_index=True, right_index=True)
 
         def gen(exp_idx):
             result = self.results[exp_idx]
-            assert len(result.cb_predictions.columns) == len(self.cb_sample)
-            # get predicted class and confidence for pseudo samples
-            iteration_list = [for_each_iteration(row, result.classes) for _, row in result.cb_predictions.iterrows()]
-            return iteration_list
+            assert result.cb_predictions.shape[1] == len(self.cb_sample)
+            # get predicted class and confidence for pseudo samples, iteration x sample
+            predicted_classes = np.asarray(result.classes)[result.cb_predictions.argmax(axis=2)]
+            confidences = result.cb_predictions.max(axis=2)
+            return [for_each_iteration(predicted_classes[i], confidences[i]) for i in range(len(confidences))]
 
         self.classification_boundaries_data = gen(0), gen(1)
         return self.classification_boundaries_data
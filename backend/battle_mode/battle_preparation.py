@@ -7,7 +7,7 @@ import pandas as pd
 
 from ..config import db
 from ..models import ALBattleConfig, Dataset
-from ..utils import timeit
+from ..utils import timeit, FeatureStore, first_label_per_sample
 
 
 class BattlePreparation:
@@ -55,11 +55,11 @@ class BattlePreparation:
     def _transform_dataset(dataset_id: int):
         dataset: Dataset = db.get(Dataset, dataset_id)
         feature_names: List[str] = dataset.feature_names.split(",")
-        frame = pd.DataFrame(data=
-                             [{f_name: f for (f_name, f) in
-                               zip(feature_names + ['LABEL', "DB_ID"],
-                                   sample.extract_feature_list() + [sample.labels[0].name, sample.id])}
-                              for sample in dataset.samples if sample.labels != []])
+        labels = first_label_per_sample(dataset_id)
+        labeled_ids = sorted(labels.keys())
+        frame = pd.DataFrame(data=FeatureStore.load(dataset_id).features_of(labeled_ids), columns=feature_names)
+        frame['LABEL'] = [labels[sample_id] for sample_id in labeled_ids]
+        frame['DB_ID'] = labeled_ids
         # TODO some models / query_strategies need number based label
         # labels = frame['LABEL'].unique()
         # label2Int = {label: i for i, label in enumerate(labels)}
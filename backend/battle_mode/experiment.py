@@ -12,7 +12,7 @@ import pandas as pd
 from alipy.data_manipulate import split
 from alipy.experiment import StoppingCriteria, StateIO, State
 from alipy.index import IndexCollection
-from sklearn.metrics import accuracy_score, f1_score, recall_score, precision_score, auc, pairwise_distances
+from sklearn.metrics import accuracy_score, pairwise_distances
 
 from ..models import (
     ALModel,
@@ -26,6 +26,7 @@ from ..models import (
     StateIOValueKeys,
     ExperimentQueueEventType,
     ExperimentQueueEvent)
+from .metrics import classification_scores, normalised_auc
 from ..utils import timeit
 
 # type-alias
@@ -94,8 +95,8 @@ class ALExperimentProcess(Process):
         # Randomly generated sample for classification boundaries
         self.cb_sample_as_numpy: np.ndarray = cb_sample.to_numpy()
         # prediction per iteration for each cb_sample
-        # column = sample, row = iteration, cell = tuple of confidence scores (one for each class)
-        self.cb_sample_predictions: pd.DataFrame = pd.DataFrame()
+        # float32 array: iteration x sample x class, value = confidence score
+        self.cb_sample_predictions: Lateinit[np.ndarray] = None
         # zero or one to identify print outputs
         self.exp_id = exp_id
         self.battle_config: ALBattleConfig = battle_config
@@ -123,8 +124,9 @@ class ALExperimentProcess(Process):
         self.unlab_ind: Lateinit[IndexCollection] = None
         self.label_ind: Lateinit[IndexCollection] = None
         # for each test sample keep track what the model predicted for each iteration
-        # column = sample_id (DB_ID), row = iteration, cell = tuple of confidence scores (one for each class)
-        self.prediction_history: Lateinit[pd.DataFrame] = None
+        # float32 array: iteration x test sample (in the order of test_sample_ids) x class, value = confidence score
+        self.prediction_history: Lateinit[np.ndarray] = None
+        self.test_sample_ids: Lateinit[List[int]] = None  # DB_ID of each test sample
         self.X_test: Lateinit[np.ndarray] = None  # all test samples as numpy array (feature matrix)
         self.y_test: Lateinit[np.ndarray] = None  # all test labels (label vector)
         self.state_saver: Lateinit[StateIO] = None  # alipy state io to keep track of additional meta information
@@ -243,10 +245,11 @@ class ALExperimentProcess(Process):
         # test data does not change: has original index equal to all_labeled_samples
 
         iteration: int = 1
-        # faster if predictions are stores as list then appending to df each iteration
-        # list-entry = iteration, dict: db_id -> tuple of confidence scores
-        predictions: List[Dict[int, Tuple[float]]] = []
-        cb_sample_predictions = []  # same as predictions just for the classification-boundaries sample
+        # the rows of X_test (and of each prediction) are the test samples in the order of test_idx
+        self.test_sample_ids = [int(self.idx2IDTest[x]) for x in self.state_saver.test_idx]
+        # list-entry = iteration, array: test sample x confidence score per class
+        predictions: List[np.ndarray] = []
+        cb_sample_predictions: List[np.ndarray] = []  # same as predictions for the classification-boundaries sample
         if self.battle_config.STOPPING_CRITERIA == StoppingCriteriaOption.CPU_TIME:
             self.stopping_criteria.reset()  # reset cpu start time 
             self.rte.start_timer()
@@ -288,13 +291,11 @@ class ALExperimentProcess(Process):
                 print(f"[{self.exp_id}] Performance: {perf}")
                 print(f"[{self.exp_id}] #Labeled: {len(self.label_ind.index)}")
 
-            # 7. add current iteration to history
-            # save samples by db_id
-            predictions.append(
-                {self.idx2IDTest[x]: pred for (x, pred) in zip(self.state_saver.test_idx, map(tuple, pred_proba))}
-            )
+            # 7. add current iteration to history, together with the classes the model knows so far
+            predictions.append((self.model.classes_, pred_proba.astype(np.float32)))
             # classify the random sample used for classification boundaries
-            cb_sample_predictions.append(list(map(tuple, self.model.predict_proba(self.cb_sample_as_numpy))))
+            cb_sample_predictions.append(
+                (self.model.classes_, self.model.predict_proba(self.cb_sample_as_numpy).astype(np.float32)))
 
             iteration += 1
             # 8. update stopping_criteria
@@ -302,8 +303,9 @@ class ALExperimentProcess(Process):
 
         print(f"[{self.exp_id}] Stopped after {iteration} iterations")
         print(f"[{self.exp_id}] Training took {round((time.time_ns() - starting_time) * 1e-9, 4)} seconds")
-        self.prediction_history = pd.DataFrame(predictions)
-        self.cb_sample_predictions = pd.DataFrame(cb_sample_predictions)
+        self.prediction_history = _stack_predictions(predictions, len(self.test_sample_ids), self.model.classes_)
+        self.cb_sample_predictions = _stack_predictions(
+            cb_sample_predictions, len(self.cb_sample_as_numpy), self.model.classes_)
 
     def _get_training_data(self):
         return (
@@ -313,16 +315,17 @@ class ALExperimentProcess(Process):
     def _get_result(self) -> ExperimentResults:
         assert len(self.state_saver) == len(self.prediction_history)
         # for each test sample save the correct label
-        # as each prediction for each test sample is a tuple of confidence scores save the correct label as index
-        # such that conf_tuple.index(max(conf_tuple)) = correct_label_as_idx
-        correct_label_as_idx = {self.idx2IDTest[idx]: self.model.classes_.tolist().index(label_str)
+        # as each prediction for each test sample is a vector of confidence scores save the correct label as index
+        # such that prediction.argmax() = correct_label_as_idx
+        correct_label_as_idx = {int(self.idx2IDTest[idx]): self.model.classes_.tolist().index(label_str)
                                 for idx, label_str in self.y_test.items()}
-        assert all([smpl_id in correct_label_as_idx for smpl_id in self.prediction_history.columns])
+        assert all([smpl_id in correct_label_as_idx for smpl_id in self.test_sample_ids])
         metric_scores = self._calc_metrics_scores()
         meta_data = self._convert_states_data()
 
         result = ExperimentResults(
             raw_predictions=self.prediction_history,
+            test_sample_ids=self.test_sample_ids,
             cb_predictions=self.cb_sample_predictions,
             metric_scores=metric_scores,
             initially_labeled=[self.idx2IDTrain[idx] for idx in self.state_saver.init_L],
@@ -337,31 +340,21 @@ class ALExperimentProcess(Process):
         Calculate Acc, F1, Recall, Precision
         @return: pandas dataframe where columns = MetricsDFKeys and each row is one iteration
         """
-        metrics_tmp = []
-        for idx, row in self.prediction_history.iterrows():
-            y_pred: List = list(map(lambda probas: self.model.classes_[probas.index(max(probas))], row))
-            y_truth: List = self.y_test.to_list()
-            assert len(y_pred) == len(y_truth)
-            acc = accuracy_score(y_truth, y_pred=y_pred)
-            f1 = f1_score(y_truth, y_pred, average='macro', zero_division=0)
-            recall = recall_score(y_truth, y_pred, average='macro', zero_division=0)
-            precision = precision_score(y_truth, y_pred, average='macro', zero_division=0)
-            metrics_tmp.append({
-                MetricsDFKeys.Acc: acc,
-                MetricsDFKeys.F1: f1,
-                MetricsDFKeys.Recall: recall,
-                MetricsDFKeys.Precision: precision
-            })
-
-        metric_scores = pd.DataFrame(metrics_tmp)
-        # Calculate F1-AUC
-        metric_scores[MetricsDFKeys.F1_AUC] = 0
-        for idx in metric_scores.index[1:]:
-            # idx +1 because current iteration should be included in calculation
-            auc_ = auc(list(range(idx + 1)), metric_scores[MetricsDFKeys.F1].iloc[:idx + 1])
-            # auc(...) / idx in order to normalize the area under the curve
-            normalised_auc = auc_ / idx
-            metric_scores.loc[idx, MetricsDFKeys.F1_AUC] = normalised_auc
+        # all iterations at once: iteration x test sample, index of the predicted class
+        predicted_idx = self.prediction_history.argmax(axis=2)
+        class_idx = {label: idx for idx, label in enumerate(self.model.classes_.tolist())}
+        true_idx = np.array([class_idx[label] for label in self.y_test.to_list()], dtype=np.int64)
+        assert predicted_idx.shape[1] == len(true_idx)
+        scores = classification_scores(true_idx, predicted_idx, len(class_idx))
+
+        metric_scores = pd.DataFrame({
+            MetricsDFKeys.Acc: scores.accuracy,
+            MetricsDFKeys.F1: scores.f1,
+            MetricsDFKeys.Recall: scores.recall,
+            MetricsDFKeys.Precision: scores.precision
+        })
+        # F1-AUC: area under the F1 curve until each iteration, normalised by the number of iterations
+        metric_scores[MetricsDFKeys.F1_AUC] = normalised_auc(scores.f1)
 
         metric_scores[MetricsDFKeys.AvgDistanceLabeled] = self._calc_average_distance(labeled=True)
         metric_scores[MetricsDFKeys.AvgDistanceUnLabeled] = self._calc_average_distance(labeled=False)
@@ -410,5 +403,20 @@ class ALExperimentProcess(Process):
         return state_data
 
 
+def _stack_predictions(predictions: List[Tuple[np.ndarray, np.ndarray]], samples: int, classes: np.ndarray) \
+        -> np.ndarray:
+    """
+    One contiguous float32 array: iteration x sample x class, the class axis in the order of `classes`.
+
+    While the labeled set is small, the model of an iteration might not know all classes yet, so each iteration is
+    given as (classes of the model, probabilities). Classes the model did not know have the probability 0.
+    """
+    stacked = np.zeros((len(predictions), samples, len(classes)), dtype=np.float32)
+    class_idx = {label: idx for idx, label in enumerate(classes.tolist())}
+    for iteration, (known_classes, probabilities) in enumerate(predictions):
+        stacked[iteration][:, [class_idx[label] for label in known_classes.tolist()]] = probabilities
+    return stacked
+
+
 def _predicted_class(model, pred_proba: List):
     return list(map(lambda array: model.classes_[array.argmax()], pred_proba))
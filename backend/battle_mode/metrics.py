@@ -0,0 +1,66 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class ClassificationScores:
+    """ Scores of each iteration, the macro averages match sklearn with `average='macro', zero_division=0` """
+    accuracy: np.ndarray
+    f1: np.ndarray
+    recall: np.ndarray
+    precision: np.ndarray
+
+
+def confusion_matrices(true_idx: np.ndarray, predicted_idx: np.ndarray, number_of_classes: int) -> np.ndarray:
+    """
+    Confusion matrix of each iteration with one `np.bincount`.
+    @param true_idx: index of the correct class per sample
+    @param predicted_idx: iteration x sample, index of the predicted class
+    @return: iteration x true class x predicted class, number of samples
+    """
+    iterations = len(predicted_idx)
+    iteration_offset = np.arange(iterations, dtype=np.int64)[:, np.newaxis] * number_of_classes ** 2
+    cells = iteration_offset + true_idx[np.newaxis, :] * number_of_classes + predicted_idx
+    counts = np.bincount(cells.ravel(), minlength=iterations * number_of_classes ** 2)
+    return counts.reshape(iterations, number_of_classes, number_of_classes)
+
+
+def classification_scores(true_idx: np.ndarray, predicted_idx: np.ndarray, number_of_classes: int) \
+        -> ClassificationScores:
+    """
+    Accuracy and macro F1, recall and precision of all iterations at once.
+
+    As in sklearn, the macro average of an iteration only includes the classes that are correct or predicted for at
+    least one sample, and a score with a zero denominator is 0.
+    """
+    matrices = confusion_matrices(true_idx, predicted_idx, number_of_classes)
+    true_positives = np.diagonal(matrices, axis1=1, axis2=2).astype(np.float64)
+    true_counts = matrices.sum(axis=2)  # iteration x class
+    predicted_counts = matrices.sum(axis=1)
+    present = (true_counts + predicted_counts) > 0
+    number_of_present = np.maximum(present.sum(axis=1), 1)
+
+    def macro(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+        per_class = np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+        return np.where(present, per_class, 0.0).sum(axis=1) / number_of_present
+
+    return ClassificationScores(
+        accuracy=true_positives.sum(axis=1) / max(len(true_idx), 1),
+        f1=macro(2 * true_positives, true_counts + predicted_counts),
+        recall=macro(true_positives, true_counts),
+        precision=macro(true_positives, predicted_counts),
+    )
+
+
+def normalised_auc(values: np.ndarray) -> np.ndarray:
+    """
+    For each iteration i > 0 the area under `values[:i + 1]` (trapezoidal rule, x = iteration) divided by i,
+    0 for the first iteration. Computed with a cumulative sum instead of one integration per iteration.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = np.zeros(len(values))
+    if len(values) > 1:
+        areas = np.cumsum((values[1:] + values[:-1]) / 2)
+        result[1:] = areas / np.arange(1, len(values))
+    return result
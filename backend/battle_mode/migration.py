@@ -0,0 +1,108 @@
+"""
+Conversion of persisted experiments of the legacy format into the current format of `Persistence`.
+
+In the legacy format the predictions were csv files with one stringified tuple per cell and the remaining results
+were pickled. Experiments are converted when they are loaded for the first time,
+`python -m backend.battle_mode.migration` converts all of them at once.
+"""
+import ast
+import pickle
+from pathlib import Path
+from typing import List, Tuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from .persistence import Persistence, ExperimentResultsPersistence, RESULTS_HEADER
+from ..config import logger
+from ..models import ExperimentResults, MetricsDFKeys
+
+# files of the legacy format, removed after the conversion
+LEGACY_FILES = ['raw_predictions', 'cb_predictions', 'metric_scores', 'pickle']
+
+
+def is_legacy_experiment(path: Path) -> bool:
+    return (path / 'pickle').exists() and not (path / RESULTS_HEADER).exists()
+
+
+def read_legacy_predictions(path: Path, name: str, number_of_classes: int) -> Tuple[np.ndarray, List[int]]:
+    """
+    Predictions persisted as csv of tuples, as array (iteration x sample x class) and the sample ids.
+
+    Models that did not know all classes yet predicted shorter tuples, which are padded with zeros to
+    `number_of_classes`. The tuples do not name their classes, so the missing ones are assumed to be the last.
+    """
+    dataframe_path = path / name
+    # convert all tuples to real tuples
+    nbr_of_columns = len(dataframe_path.open(mode='r').readline().split(","))
+    dataframe = pd.read_csv(
+        dataframe_path.absolute(),
+        index_col=0,
+        converters={col: ast.literal_eval for col in range(nbr_of_columns)}
+    )
+    # columns should be integer instead of strings
+    sample_ids = [int(column) for column in dataframe.columns]
+    predictions = np.zeros((len(dataframe.index), len(sample_ids), number_of_classes), dtype=np.float32)
+    for iteration, row in enumerate(dataframe.itertuples(index=False)):
+        for sample, probabilities in enumerate(row):
+            predictions[iteration, sample, :len(probabilities)] = probabilities
+    return predictions, sample_ids
+
+
+def read_legacy_results(path: Path) -> ExperimentResults:
+    metric_scores = pd.read_csv((path / 'metric_scores').absolute(), index_col=0)
+    metric_scores.columns = metric_scores.columns.map(MetricsDFKeys)
+
+    with (path / 'pickle').open(mode='rb') as file:
+        persisted_obj: ExperimentResultsPersistence = pickle.load(file=file)
+
+    test_sample_ids: Optional[List[int]] = getattr(persisted_obj, 'test_sample_ids', None)
+    if (path / 'raw_predictions.npy').exists() and test_sample_ids is not None:
+        # the predictions were already arrays, only the remaining results are pickled
+        raw_predictions = np.load(path / 'raw_predictions.npy')
+        cb_predictions = np.load(path / 'cb_predictions.npy')
+    else:
+        number_of_classes = len(persisted_obj.classes)
+        raw_predictions, test_sample_ids = read_legacy_predictions(path, 'raw_predictions', number_of_classes)
+        cb_predictions, _ = read_legacy_predictions(path, 'cb_predictions', number_of_classes)
+
+    return ExperimentResults(
+        raw_predictions=raw_predictions,
+        test_sample_ids=test_sample_ids,
+        initially_labeled=persisted_obj.initially_labeled,
+        cb_predictions=cb_predictions,
+        metric_scores=metric_scores,
+        correct_label_as_idx=persisted_obj.correct_label_as_idx,
+        meta_data=persisted_obj.meta_data,
+        classes=persisted_obj.classes
+    )
+
+
+def migrate_experiment_results(path: Path) -> None:
+    """ Rewrites the results of one experiment (one of the two directories of a battle) in the current format """
+    logger.info(f"Converting experiment results of the legacy format: {path}")
+    results = read_legacy_results(path)
+    Persistence._serialize_single_exp(results, path)
+    for name in LEGACY_FILES:
+        legacy_path = path / name
+        if legacy_path.exists():
+            legacy_path.unlink()
+
+
+def migrate_experiments(data_path: Path = None) -> int:
+    """ Converts all persisted experiments of the legacy format, returns the number of converted experiments """
+    if data_path is None:
+        data_path = Persistence.data_path
+    if not data_path.exists():
+        return 0
+    migrated = 0
+    for exp_path in sorted(data_path.iterdir()):
+        for results_path in (exp_path / str(1), exp_path / str(2)):
+            if is_legacy_experiment(results_path):
+                migrate_experiment_results(results_path)
+                migrated += 1
+    return migrated
+
+
+if __name__ == '__main__':
+    logger.info(f"Converted {migrate_experiments()} experiment results")
@@ -1,10 +1,12 @@
-import ast
+import json
 import pickle
 import shutil
+from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Optional
 
+import numpy as np
 import pandas as pd
 
 from .battle_manager import BattleAnalyzer, BattleManager
@@ -12,8 +14,18 @@ from ..config import logger, DATA_PATH
 from ..models import BattleMetaPersistence, MetaData, ExperimentResults,MetricsDFKeys
 
 
+# version of the files of persisted experiment results, 1 was the csv format (see `migration`)
+RESULTS_FORMAT_VERSION = 2
+RESULTS_HEADER = 'results.json'
+# meta of all persisted experiments in data_path, and the meta of each experiment in its directory
+INDEX_FILE = 'index.json'
+INDEX_VERSION = 1
+META_FILE = 'meta.json'
+
+
 @dataclass
 class ExperimentResultsPersistence:
+    """ Pickled results of the legacy format, only needed to read (migrate) experiments of that format """
     meta_data: List[MetaData]
     classes: List[str]
     correct_label_as_idx: Dict[int, int]
@@ -22,34 +34,95 @@ class ExperimentResultsPersistence:
 
 class Persistence:
     data_path = DATA_PATH / 'experiments'
-    persisted_experiments: Dict[int, BattleMetaPersistence] = {}
+    # experiment_id -> meta, read from the index on first access (see `restore_if_necessary`)
+    _persisted_experiments: Optional[Dict[int, BattleMetaPersistence]] = None
 
     def __init__(self):
         raise ValueError("Persistence should not be instantiated.")
 
+    @staticmethod
+    def _index_path() -> Path:
+        return Persistence.data_path / INDEX_FILE
+
+    @staticmethod
+    def restore_if_necessary() -> Dict[int, BattleMetaPersistence]:
+        if Persistence._persisted_experiments is None:
+            Persistence.restore()
+        return Persistence._persisted_experiments
+
     @staticmethod
     def restore():
-        if not Persistence.data_path.exists():
-            Persistence.data_path.mkdir(parents=True)
-            return
+        """ Reads the index of all persisted experiments, it is rebuilt from the experiment directories if necessary """
+        Persistence.data_path.mkdir(parents=True, exist_ok=True)
+        experiments = Persistence._read_index()
+        if experiments is None:
+            experiments = Persistence._rebuild_index()
+        Persistence._persisted_experiments = experiments
+        if len(experiments) > 0:
+            # new experiments must not get the id of a persisted one
+            highest_persisted_id = max(experiments.keys())
+            BattleManager._experiment_id_counter = \
+                max(BattleManager.get_experiment_id_counter(), highest_persisted_id + 1)
+
+    @staticmethod
+    def _read_index() -> Optional[Dict[int, BattleMetaPersistence]]:
+        index_path = Persistence._index_path()
+        if not index_path.exists():
+            return None
+        try:
+            with index_path.open(mode='r') as file:
+                index = json.load(file)
+            if index['version'] != INDEX_VERSION:
+                return None
+            return {record['experiment_id']: Persistence._meta_of(record) for record in index['experiments']}
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warn(f"Failed reading the index of persisted experiments: {repr(e)}")
+            return None
+
+    @staticmethod
+    def _rebuild_index() -> Dict[int, BattleMetaPersistence]:
+        logger.info("Building the index of persisted experiments")
+        experiments: Dict[int, BattleMetaPersistence] = {}
         for path in Persistence.data_path.iterdir():
-            if not path.is_dir():
+            if path.name == INDEX_FILE:
+                continue
+            if not path.is_dir() or not path.name.isdigit():
                 logger.warn(f"Unexpected file found in experiments: {path}")
                 continue
             exp_id = int(path.name)
-            try:
-                meta = Persistence._load_meta(path)
-                Persistence.persisted_experiments[exp_id] = meta
-            except ValueError:
-                logger.warn(f"Directory with invalid name in experiments: {path}")
+            if not (path / META_FILE).exists() and not (path / 'meta').exists():
+                # the meta is written last, storing the experiment was interrupted
+                logger.warn(f"Incomplete experiment found in experiments: {path}")
                 Persistence._purge(path, exp_id)
-            except EOFError as e:
+                continue
+            try:
+                experiments[exp_id] = Persistence._load_meta(path)
+            except (EOFError, ValueError, OSError, pickle.UnpicklingError) as e:
                 logger.warn(f"Failed loading meta with exception: {repr(e)}")
                 Persistence._purge(path, exp_id)
-        if len(Persistence.persisted_experiments) > 0:
-            highest_persisted_id = max(Persistence.persisted_experiments.keys())
-            BattleManager._experiment_id_counter = \
-                max(BattleManager.get_experiment_id_counter(), highest_persisted_id + 1)
+        Persistence._write_index(experiments)
+        return experiments
+
+    @staticmethod
+    def _write_index(experiments: Dict[int, BattleMetaPersistence]):
+        index = {
+            'version': INDEX_VERSION,
+            'experiments': [Persistence._record_of(experiments[exp_id]) for exp_id in sorted(experiments)]
+        }
+        # write to a temporary file first, the index is never read half written
+        tmp_path = Persistence._index_path().with_suffix('.tmp')
+        with tmp_path.open(mode='w') as file:
+            json.dump(index, file)
+        tmp_path.replace(Persistence._index_path())
+
+    @staticmethod
+    def _record_of(meta: BattleMetaPersistence) -> Dict:
+        # the path is not stored, it follows from the experiment id
+        return json.loads(meta.json(exclude={'path'}))
+
+    @staticmethod
+    def _meta_of(record: Dict) -> BattleMetaPersistence:
+        return BattleMetaPersistence(**record, path=Persistence.data_path / str(record['experiment_id']))
 
     @staticmethod
     def _purge(path: Path, exp_id: int):
@@ -60,18 +133,28 @@ class Persistence:
 
     @staticmethod
     def delete(experiment_id: int):
-        meta: BattleMetaPersistence = Persistence.persisted_experiments[experiment_id]
+        experiments = Persistence.restore_if_necessary()
+        meta: BattleMetaPersistence = experiments[experiment_id]
         path: Path = meta.path
         Persistence._purge(path, experiment_id)
-        del Persistence.persisted_experiments[experiment_id]
+        del experiments[experiment_id]
+        Persistence._write_index(experiments)
+
+    @staticmethod
+    def is_persisted(experiment_id: int) -> bool:
+        return experiment_id in Persistence.restore_if_necessary()
+
+    @staticmethod
+    def get_meta(experiment_id: int) -> BattleMetaPersistence:
+        return Persistence.restore_if_necessary()[experiment_id]
 
     @staticmethod
-    def get_storage_overview():
-        return Persistence.persisted_experiments
+    def get_storage_overview() -> Dict[int, BattleMetaPersistence]:
+        return Persistence.restore_if_necessary()
 
     @staticmethod
     def store_finished_experiments(exp_id: int, finished_manager: BattleAnalyzer):
-        Persistence.data_path.mkdir(parents=True, exist_ok=True)  # ensure data_path exists
+        experiments = Persistence.restore_if_necessary()  # ensures data_path exists
         exp_path = Persistence.data_path / str(exp_id)
         if exp_path.exists():
             logger.warn("Overwriting persisted experiment: " + str(exp_id))
@@ -83,23 +166,23 @@ class Persistence:
             dataset_id=finished_manager.dataset_id,
             config=finished_manager.config,
             path=exp_path)
-        Persistence._store_meta(exp_path, meta)
         Persistence._store_experiments(exp_path, finished_manager.results[0], finished_manager.results[1])
-        Persistence.persisted_experiments[exp_id] = meta
+        # the meta is stored last, it is the marker of a complete experiment
+        Persistence._store_meta(exp_path, meta)
+        experiments[exp_id] = meta
+        Persistence._write_index(experiments)
 
     @staticmethod
     def _store_meta(exp_path: Path, meta: BattleMetaPersistence):
-        meta_path = exp_path / 'meta'
-        with meta_path.open(mode='wb') as file:
-            pickle.dump(meta, file)
+        with (exp_path / META_FILE).open(mode='w') as file:
+            json.dump(Persistence._record_of(meta), file)
 
     @staticmethod
     def _store_experiments(exp_path: Path, exp_one: ExperimentResults, exp_two: ExperimentResults):
         # Make sure /data exists
         # Create Folder with name = id
         # Create Folder for exp_one and exp_two
-        # each dataframe from ExperimentResults is a csv
-        # everything else gets pickled
+        # see _serialize_single_exp for the files of each experiment
         exp_one_path = exp_path / str(1)
         exp_two_path = exp_path / str(2)
         Persistence._serialize_single_exp(exp_one, exp_one_path)
@@ -107,67 +190,78 @@ class Persistence:
 
     @staticmethod
     def _serialize_single_exp(exp_obj: ExperimentResults, path: Path):
+        """
+        Each array is stored as `.npy` file (memory-mapped when loaded), everything else in the json header.
+        The header is written last, an experiment without header is incomplete or of the legacy format.
+        Every file is written to a temporary file first and then replaces the old one: the results might be
+        memory-mapped from the very files that are overwritten (storing a loaded experiment again).
+        """
         if not path.exists():
             path.mkdir()
-        raw_predictions_path = path / 'raw_predictions'
-        exp_obj.raw_predictions.to_csv(raw_predictions_path.absolute())
-
-        cb_predictions_path = path / 'cb_predictions'
-        exp_obj.cb_predictions.to_csv(cb_predictions_path.absolute())
-
-        metric_scores_path = path / 'metric_scores'
-        exp_obj.metric_scores.to_csv(metric_scores_path.absolute())
-
-        pickle_file_path = path / 'pickle'
-        # dont save pandas dataframes
-        persisted_results = ExperimentResultsPersistence(
-            classes=exp_obj.classes,
-            initially_labeled=exp_obj.initially_labeled,
-            correct_label_as_idx=exp_obj.correct_label_as_idx,
-            meta_data=exp_obj.meta_data
-        )
-        with pickle_file_path.open(mode='wb') as file:
-            pickle.dump(obj=persisted_results, file=file)
+        metric_columns = [MetricsDFKeys(column) for column in exp_obj.metric_scores.columns]
+        arrays = {
+            'raw_predictions': np.asarray(exp_obj.raw_predictions, dtype=np.float32),
+            'cb_predictions': np.asarray(exp_obj.cb_predictions, dtype=np.float32),
+            'test_sample_ids': np.asarray(exp_obj.test_sample_ids, dtype=np.int64),
+            'metric_scores': exp_obj.metric_scores.to_numpy(dtype=np.float64),
+        }
+        for name, array in arrays.items():
+            with Persistence._replacing(path / f'{name}.npy', mode='wb') as file:
+                np.save(file, np.ascontiguousarray(array))
+
+        header = {
+            'format_version': RESULTS_FORMAT_VERSION,
+            'metric_columns': [column.value for column in metric_columns],
+            'classes': np.asarray(exp_obj.classes).tolist(),
+            'initially_labeled': [int(sample_id) for sample_id in exp_obj.initially_labeled],
+            'correct_label_as_idx': [[int(sample_id), int(idx)] for sample_id, idx in
+                                     exp_obj.correct_label_as_idx.items()],
+            'meta_data': [json.loads(meta.json()) for meta in exp_obj.meta_data],
+        }
+        with Persistence._replacing(path / RESULTS_HEADER, mode='w') as file:
+            json.dump(header, file)
+
+    @staticmethod
+    @contextmanager
+    def _replacing(path: Path, mode: str):
+        """ File that replaces `path` once it is written completely, readers never see a half written file """
+        tmp_path = path.with_name(path.name + '.tmp')
+        try:
+            with tmp_path.open(mode=mode) as file:
+                yield file
+            tmp_path.replace(path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
 
     @staticmethod
     def _deserialize_single_exp(path: Path) -> ExperimentResults:
-        # minus one because the index column is represented too
-        raw_predictions = Persistence._deserialize_predictions_dataframe(path, 'raw_predictions')
-
-        cb_predictions = Persistence._deserialize_predictions_dataframe(path, 'cb_predictions')
-
-        metric_scores_path = path / 'metric_scores'
-        metric_scores = pd.read_csv(metric_scores_path.absolute(), index_col=0)
-        metric_scores.columns = metric_scores.columns.map(MetricsDFKeys)
-
-        pickle_file_path = path / 'pickle'
-
-        with pickle_file_path.open(mode='rb') as file:
-            persisted_obj: ExperimentResultsPersistence = pickle.load(file=file)
-            exp_results = ExperimentResults(
-                raw_predictions=raw_predictions,
-                initially_labeled=persisted_obj.initially_labeled,
-                cb_predictions=cb_predictions,
-                metric_scores=metric_scores,
-                correct_label_as_idx=persisted_obj.correct_label_as_idx,
-                meta_data=persisted_obj.meta_data,
-                classes=persisted_obj.classes
-            )
-            return exp_results
-
-    @staticmethod
-    def _deserialize_predictions_dataframe(path: Path, name: str):
-        dataframe_path = path / name
-        # convert all tuples to real tuples
-        nbr_of_columns = len(dataframe_path.open(mode='r').readline().split(","))
-        dataframe = pd.read_csv(
-            dataframe_path.absolute(),
-            index_col=0,
-            converters={col: ast.literal_eval for col in range(nbr_of_columns)}
+        if not (path / RESULTS_HEADER).exists():
+            # experiments of the legacy format are converted once (import here, the migration uses this class)
+            from .migration import migrate_experiment_results
+            migrate_experiment_results(path)
+
+        with (path / RESULTS_HEADER).open(mode='r') as file:
+            header = json.load(file)
+        if header['format_version'] != RESULTS_FORMAT_VERSION:
+            raise ValueError(f"Unsupported format version {header['format_version']} of experiment: {path}")
+
+        def load(name: str, mmap_mode: Optional[str] = 'r') -> np.ndarray:
+            # memory-mapped: only the parts of the predictions that are accessed are read from disk
+            return np.load(path / f'{name}.npy', mmap_mode=mmap_mode)
+
+        metric_scores = pd.DataFrame(load('metric_scores', mmap_mode=None),
+                                     columns=[MetricsDFKeys(column) for column in header['metric_columns']])
+        return ExperimentResults(
+            raw_predictions=load('raw_predictions'),
+            test_sample_ids=load('test_sample_ids', mmap_mode=None).tolist(),
+            initially_labeled=header['initially_labeled'],
+            cb_predictions=load('cb_predictions'),
+            metric_scores=metric_scores,
+            correct_label_as_idx={sample_id: idx for sample_id, idx in header['correct_label_as_idx']},
+            meta_data=[MetaData(**meta) for meta in header['meta_data']],
+            classes=header['classes']
         )
-        # columns should be integer instead of strings
-        dataframe.columns = dataframe.columns.astype(int)
-        return dataframe
 
     @staticmethod
     def _load_experiments(exp_path: Path) -> Tuple[ExperimentResults, ExperimentResults]:
@@ -180,23 +274,31 @@ class Persistence:
         return exp_one, exp_two
 
     @staticmethod
-    def _load_meta(exp_path: Path):
-        meta_path = exp_path / 'meta'
-        with meta_path.open(mode='rb') as file:
-            meta = pickle.load(file)
-            return meta
+    def _load_meta(exp_path: Path) -> BattleMetaPersistence:
+        meta_path = exp_path / META_FILE
+        if meta_path.exists():
+            with meta_path.open(mode='r') as file:
+                return Persistence._meta_of(json.load(file))
+
+        # experiments persisted before the meta was json, converted once
+        with (exp_path / 'meta').open(mode='rb') as file:
+            meta: BattleMetaPersistence = pickle.load(file)
+        meta = Persistence._meta_of(Persistence._record_of(meta))
+        Persistence._store_meta(exp_path, meta)
+        (exp_path / 'meta').unlink()
+        return meta
 
     @staticmethod
     def load_finished_experiments(exp_id: int) -> BattleAnalyzer:
 
-        if exp_id not in Persistence.persisted_experiments:
+        if not Persistence.is_persisted(exp_id):
             raise ValueError(f"Experiment for ID = {exp_id} does not exist")
-        exp_path = Persistence.persisted_experiments[exp_id].path
+        meta: BattleMetaPersistence = Persistence.get_meta(exp_id)
+        exp_path = meta.path
 
         cb_sample_path = exp_path / 'cb_sample'
         cb_sample = pd.read_csv(cb_sample_path.absolute(), index_col=0)
         exp_one, exp_two = Persistence._load_experiments(exp_path)
-        meta: BattleMetaPersistence = Persistence._load_meta(exp_path)
         return BattleAnalyzer(
             experiment_id=exp_id,
             dataset_id=meta.dataset_id,
@@ -205,6 +307,3 @@ class Persistence:
             result_one=exp_one,
             result_two=exp_two)
 
-
-# restore all experiments on load
-Persistence.restore()
@@ -4,3 +4,5 @@ from .logger import *
 from .security import *
 from .users import *
 from .data import *
+from .blob_store import *
+from .workers import *
@@ -1,7 +1,7 @@
 from fastapi import FastAPI
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.cors import CORSMiddleware
-from .database import automatic_transaction
+from .database import automatic_transaction, request_session
 
 app = FastAPI()
 
@@ -14,3 +14,5 @@ app.add_middleware(
 )
 
 app.add_middleware(BaseHTTPMiddleware, dispatch=automatic_transaction)
+# added last, so that it wraps the other middlewares and the transaction handling uses the session of the request
+app.add_middleware(BaseHTTPMiddleware, dispatch=request_session)
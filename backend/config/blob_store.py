@@ -0,0 +1,48 @@
+import hashlib
+import os
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from .data import DATA_PATH
+
+
+class BlobStore:
+    """
+    Content-addressed storage of binary sample contents (e.g. images) on disk.
+
+    A blob is stored under the sha256 hash of its data, so identical contents are stored only once and the hash can
+    be used as ETag. The database only keeps the hash, large contents are never transferred by sample queries.
+    """
+    data_path = DATA_PATH / 'blobs'
+
+    def __init__(self):
+        raise ValueError("BlobStore should not be instantiated.")
+
+    @staticmethod
+    def path(content_hash: str) -> Path:
+        return BlobStore.data_path / content_hash[:2] / content_hash[2:]
+
+    @staticmethod
+    def put(data: bytes) -> str:
+        """ Store the data if it is not stored yet, returns its hash """
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = BlobStore.path(content_hash)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # write to a temporary file first, readers should never see a half written blob. The name is unique across
+            # the import processes, which might store the same blob at the same time.
+            with NamedTemporaryFile(dir=path.parent, suffix='.tmp', delete=False) as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_file.name, path)
+        return content_hash
+
+    @staticmethod
+    def get(content_hash: str) -> bytes:
+        return BlobStore.path(content_hash).read_bytes()
+
+    @staticmethod
+    def delete(content_hash: str) -> None:
+        """ Only for blobs that are not referenced anymore """
+        path = BlobStore.path(content_hash)
+        if path.exists():
+            path.unlink()
@@ -1,3 +1,6 @@
+import os
 from pathlib import Path
 
-DATA_PATH = (Path(__file__).absolute() / "../../data").resolve()
\ No newline at end of file
+DATA_PATH = (Path(__file__).absolute() / "../../data").resolve()
+# number of processes importing the bundled test datasets at startup
+IMPORT_PROCESSES = int(os.getenv('IMPORT_PROCESSES', default=str(min(4, os.cpu_count() or 1))))
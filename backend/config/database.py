@@ -1,10 +1,16 @@
+import itertools
 import os
+import threading
+from contextvars import ContextVar
+from typing import Optional
 
 from fastapi import HTTPException, status
 from sqlalchemy import create_engine
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 
 # set access parameters for server and database
 from starlette.requests import Request
@@ -18,9 +24,20 @@ db_name = "etikedi"
 
 SQLALCHEMY_DATABASE_URI = "postgresql+psycopg2://{}:{}@{}:{}/{}" \
     .format(server_username, server_password, server_ipaddress, server_port, db_name)
+# same database, used by the read-heavy routes that should not block the event loop
+ASYNC_SQLALCHEMY_DATABASE_URI = "postgresql+asyncpg://{}:{}@{}:{}/{}" \
+    .format(server_username, server_password, server_ipaddress, server_port, db_name)
+
+# connections kept open per process and the number of additional connections opened under load
+DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', default='10'))
+DATABASE_MAX_OVERFLOW = int(os.getenv('DATABASE_MAX_OVERFLOW', default='20'))
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URI,
+    poolclass=QueuePool,
+    pool_size=DATABASE_POOL_SIZE,
+    max_overflow=DATABASE_MAX_OVERFLOW,
+    pool_pre_ping=True,
     connect_args={
         "connect_timeout": 30
     },
@@ -30,16 +47,83 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# id of the request that is currently handled, set by `request_session` (also in the threadpool, which copies the
+# context). Outside of requests (startup, worker processes, threads) every thread has its own session.
+_request_scope: ContextVar[Optional[int]] = ContextVar('request_scope', default=None)
+_request_ids = itertools.count()
+
+
+def _session_scope():
+    request_id = _request_scope.get()
+    return ('request', request_id) if request_id is not None else ('thread', threading.get_ident())
+
+
+# the session of the current request, used like a session (`db.query(...)`, `db.commit()`)
+db = scoped_session(SessionLocal, scopefunc=_session_scope)
+
 
 def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    """ Dependency for the session of the current request """
+    yield db()
+
+
+_async_sessionmaker: Optional[sessionmaker] = None
+
 
+def async_sessionmaker() -> sessionmaker:
+    """ The async engine is created on first use, so only the API process (never a worker process) creates it """
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        async_engine = create_async_engine(
+            ASYNC_SQLALCHEMY_DATABASE_URI,
+            pool_size=DATABASE_POOL_SIZE,
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            connect_args={
+                "timeout": 30
+            },
+        )
+        _async_sessionmaker = sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    return _async_sessionmaker
 
-db: SessionLocal = next(get_db())
+
+async def get_async_db():
+    """
+    Dependency for an async session, the queries are awaited instead of blocking the event loop.
+
+    Lazy loading is not possible with an async session, everything a route returns has to be loaded by its query.
+    """
+    async with async_sessionmaker()() as session:
+        yield session
+
+
+# pools inherited from the parent process, referenced so that their connections are never closed (garbage collected)
+# by a forked process, closing them would terminate the connections of the parent
+_inherited_pools = []
+
+
+def _after_fork_in_child():
+    # the connections (and sessions using them) of the parent process must never be used by a forked process,
+    # e.g. the active learning workers, the battle preparation or the import processes open their own connections
+    global _async_sessionmaker
+    _async_sessionmaker = None
+    db.registry.registry.clear()
+    # engine.dispose(close=False) needs SQLAlchemy 1.4.33, the lock pins 1.4.31: swap in a new pool by hand
+    _inherited_pools.append(engine.pool)
+    engine.pool = engine.pool.recreate()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+async def request_session(request: Request, call_next):
+    """ Every request gets its own session (and connection), which is closed when the response is sent """
+    token = _request_scope.set(next(_request_ids))
+    try:
+        return await call_next(request)
+    finally:
+        db.remove()
+        _request_scope.reset(token)
 
 
 async def automatic_transaction(request: Request, call_next):
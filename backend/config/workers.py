@@ -0,0 +1,8 @@
+import os
+
+# maximum number of active learning processes running at the same time, the least recently used one is stopped first
+MAX_AL_WORKERS = int(os.getenv('MAX_AL_WORKERS', default='4'))
+# upper bound for the summed resident memory of all active learning processes in MB, 0 disables the limit
+MAX_AL_WORKER_MEMORY_MB = int(os.getenv('MAX_AL_WORKER_MEMORY_MB', default='0'))
+# seconds between two checks for idle workers and the memory limit
+AL_WORKER_CHECK_INTERVAL = int(os.getenv('AL_WORKER_CHECK_INTERVAL', default='30'))
@@ -1,76 +1,147 @@
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
 
 from .cifar import convert_cifar
 from .dwtc import convert_dwtc
 from .religious_texts import convert_religions_texts
-from .uci import import_uci
+from .uci import import_uci, prepare_uci
 from ..models import Dataset
-from ..config import db, logger, DATA_PATH
+from ..config import db, logger, DATA_PATH, IMPORT_PROCESSES, SQLALCHEMY_DATABASE_URI
+
+UCI_DATASETS = [
+    "glass",
+    "zoo",
+    "HABERMAN",
+    "GERMAN",
+    "parkinsons",
+    "PLANNING",
+    "ILPD",
+    "flag",
+    "DIABETES",
+    "FERTILITY",
+    "australian",
+    "IONOSPHERE",
+    "PIMA",
+    "adult",
+    "HEART",
+    "wine",
+    "BREAST",
+    "abalone",
+]
+
+
+def _test_datasets() -> Dict[str, Callable[[Path], None]]:
+    """ Dataset name -> importer, the large datasets first so that the small ones fill the gaps """
+    importers = {
+        "CIFAR": convert_cifar,
+        "DWTC": convert_dwtc,
+        "Religions Texts": convert_religions_texts,
+    }
+    importers.update({name: partial(import_uci, name) for name in UCI_DATASETS})
+    return importers
+
+
+class ImportManifest:
+    """
+    Cache of the already imported test datasets (name -> dataset id) in the data directory.
+
+    The manifest only belongs to the database it was written for (checksum of the database URI) and is validated
+    with a single query, datasets that were deleted in the meantime are imported again.
+    """
+    path = DATA_PATH / "import_manifest.json"
+
+    def __init__(self):
+        raise ValueError("ImportManifest should not be instantiated.")
+
+    @staticmethod
+    def _checksum() -> str:
+        return hashlib.sha256(SQLALCHEMY_DATABASE_URI.encode()).hexdigest()
+
+    @staticmethod
+    def load() -> Dict[str, int]:
+        if not ImportManifest.path.exists():
+            return {}
+        try:
+            manifest = json.loads(ImportManifest.path.read_text())
+        except ValueError:
+            return {}
+        if manifest.get("checksum") != ImportManifest._checksum():
+            return {}
+        return manifest["datasets"]
+
+    @staticmethod
+    def save(datasets: Dict[str, int]) -> None:
+        ImportManifest.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = ImportManifest.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"checksum": ImportManifest._checksum(), "datasets": datasets}, indent=2))
+        tmp_path.replace(ImportManifest.path)
+
+    @staticmethod
+    def imported_datasets(names) -> Dict[str, int]:
+        """ Name -> id of the given datasets that exist in the database """
+        manifest = ImportManifest.load()
+        if set(names).issubset(manifest):
+            # one query for all datasets instead of one per dataset
+            existing_ids = {dataset_id for dataset_id, in db.query(Dataset.id)
+                            .filter(Dataset.id.in_([manifest[name] for name in names]))}
+            if all(manifest[name] in existing_ids for name in names):
+                return {name: manifest[name] for name in names}
+
+        existing = dict(db.query(Dataset.name, Dataset.id).filter(Dataset.name.in_(list(names))))
+        ImportManifest.save(existing)
+        return existing
+
+
+def _import_test_dataset(name: str, importer: Callable[[Path], None], data_path: Path) -> Tuple[str, Optional[str]]:
+    """ Runs in an import process, returns the name and the error message if the import failed """
+    try:
+        logger.info(f"Importing {name}")
+        importer(data_path)
+        db.commit()
+        return name, None
+    except Exception as e:
+        db.rollback()
+        return name, e.message if hasattr(e, "message") else str(e)
 
 
 def import_test_datasets(data_path: Path = None):
     if data_path is None:
         data_path = DATA_PATH
     data_path.mkdir(parents=True, exist_ok=True)
-    existing_dataset_names = [d.name for d in db.query(Dataset).all()]
-    try:
-        if "CIFAR" not in existing_dataset_names:
-            convert_cifar(data_path)
-    except Exception as e:
-        error = e.message if hasattr(e, "message") else str(e)
-        logger.warning("Could not import CIFAR dataset. Failed with message: " + error)
-    try:
-        if "DWTC" not in existing_dataset_names:
-            convert_dwtc(data_path)
-    except Exception as e:
-        error = e.message if hasattr(e, "message") else str(e)
-        logger.warning("Could not import dwtc dataset. Failed with message: " + error)
 
-    try:
-        if "Religions Texts" not in existing_dataset_names:
-            convert_religions_texts(data_path)
-    except Exception as e:
-        error = e.message if hasattr(e, "message") else str(e)
-        logger.warning(
-            "Could not import religions_texts dataset. Failed with message: " + error
-        )
-
-    uci_datasets = [
-        "glass",
-        "zoo",
-        "HABERMAN",
-        "GERMAN",
-        "parkinsons",
-        "PLANNING",
-        "ILPD",
-        "flag",
-        "DIABETES",
-        "FERTILITY",
-        "australian",
-        "IONOSPHERE",
-        "PIMA",
-        "adult",
-        "HEART",
-        "wine",
-        "BREAST",
-        "abalone",
-    ]
-
-    for uci_dataset in uci_datasets:
+    importers = _test_datasets()
+    imported = ImportManifest.imported_datasets(list(importers))
+    missing = {name: importer for name, importer in importers.items() if name not in imported}
+    if not missing:
+        logger.info("All test datasets exist already")
+        return
+
+    if any(name in UCI_DATASETS for name in missing):
         try:
-            if uci_dataset not in existing_dataset_names:
-                logger.info("import uci " + uci_dataset)
-                import_uci(uci_dataset, data_path)
-            else:
-                logger.info("uci " + uci_dataset + " exists already")
+            # the uci datasets share one archive, it is downloaded and extracted before the imports start
+            prepare_uci(data_path)
         except Exception as e:
             error = e.message if hasattr(e, "message") else str(e)
-            logger.warning(
-                "Could not import uci dataset "
-                + uci_dataset
-                + ". Failed with message: "
-                + error
-            )
+            logger.warning("Could not download uci datasets, skipping them. Failed with message: " + error)
+            # otherwise every import process would try to download and extract the same archive
+            missing = {name: importer for name, importer in missing.items() if name not in UCI_DATASETS}
+
+    # no connection of this process may be in use while the import processes are forked
+    db.close()
+    # the forked import processes open their own connections (see `config.database`)
+    with ProcessPoolExecutor(max_workers=IMPORT_PROCESSES) as executor:
+        futures = [executor.submit(_import_test_dataset, name, importer, data_path)
+                   for name, importer in missing.items()]
+        for future in futures:
+            name, error = future.result()
+            if error is not None:
+                logger.warning(f"Could not import {name} dataset. Failed with message: " + error)
+
+    ImportManifest.save(dict(db.query(Dataset.name, Dataset.id).filter(Dataset.name.in_(list(importers)))))
 
 
 if __name__ == "__main__":
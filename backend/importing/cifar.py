@@ -1,5 +1,5 @@
-import csv
 import pickle
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 from itertools import product
 from pathlib import Path
@@ -7,6 +7,7 @@ from typing import List
 from zipfile import ZipFile
 
 import numpy as np
+import pandas as pd
 from PIL import Image as PillowImage
 
 from .generic import import_dataset
@@ -16,27 +17,31 @@ from ..models import Image
 
 CIFAR_FILES = [
     "data_batch_1",
-    # 'data_batch_2',
-    # 'data_batch_3',
-    # 'data_batch_4',
-    # 'data_batch_5'
+    "data_batch_2",
+    "data_batch_3",
+    "data_batch_4",
+    "data_batch_5",
 ]
+# number of images encoded by one task of the process pool
+ENCODING_CHUNK_SIZE = 1000
 
 
-def convert_cifar_to_png(pixels) -> bytes:
+def convert_cifar_to_png(pixels: np.ndarray) -> bytes:
     """
-    A list where the first third are the red values, the second thirds the green values and the last
-    third the blue values
+    An array where the first third are the red values, the second thirds the green values and the last
+    third the blue values, each row by row
     """
-    image = PillowImage.new("RGB", (32, 32))
-    pixel_iterator = zip(*np.array_split(pixels, 3))
-    image.putdata(list(pixel_iterator))
+    image = PillowImage.fromarray(pixels.reshape(3, 32, 32).transpose(1, 2, 0).astype(np.uint8), "RGB")
 
     stream = BytesIO()
     image.save(stream, format="PNG")
     return stream.getvalue()
 
 
+def convert_cifar_chunk_to_png(images: np.ndarray) -> List[bytes]:
+    return [convert_cifar_to_png(pixels) for pixels in images]
+
+
 def get_cifar_meta(path: Path) -> List[str]:
     with path.open('rb') as f:
         raw_meta = pickle.load(f, encoding="bytes")
@@ -60,30 +65,42 @@ def convert_cifar(data_path: Path):
     target_zip_path = cifar_path / "cifar.zip"
 
     if not (target_csv_path.exists() and target_zip_path.exists()):
-        with ZipFile(target_zip_path.open("wb"), "w") as zip_file, target_csv_path.open("w") as csv_file:
+        with ZipFile(target_zip_path.open("wb"), "w") as zip_file, target_csv_path.open("w") as csv_file, \
+                ProcessPoolExecutor() as executor:
             identifier = 1
 
             meta = get_cifar_meta(cifar_path / 'batches.meta')
 
-            csv_writer = csv.writer(csv_file)
             colors = ["red", "green", "blue"]
             color_features = [
                 f"{color}{index}"
                 for color, index in product(colors, range(1, 1024 + 1))
             ]
             feature_names = ["ID"] + color_features + ["LABEL"]
-            csv_writer.writerow(feature_names)
+            csv_file.write(",".join(feature_names) + "\n")
 
             for file_index, file in enumerate(CIFAR_FILES, 1):
                 logger.info(f"Converting CIFAR {file_index}/{len(CIFAR_FILES)}")
 
                 with (cifar_path / file).open("rb") as f:
                     data = pickle.load(f, encoding="bytes")
-
-                for pixels, label in zip(data[b"data"], data[b"labels"]):
-                    zip_file.writestr(f"{identifier}.raw", convert_cifar_to_png(pixels))
-                    csv_writer.writerow([identifier] + list(pixels) + [meta[label]])
-                    identifier += 1
+                images = np.asarray(data[b"data"], dtype=np.uint8)
+                labels = [meta[label] for label in data[b"labels"]]
+
+                # the images are encoded in parallel, map keeps the order of the chunks
+                chunks = (images[start:start + ENCODING_CHUNK_SIZE]
+                          for start in range(0, len(images), ENCODING_CHUNK_SIZE))
+                image_identifier = identifier
+                for png_images in executor.map(convert_cifar_chunk_to_png, chunks):
+                    for png_image in png_images:
+                        zip_file.writestr(f"{image_identifier}.raw", png_image)
+                        image_identifier += 1
+
+                features = pd.DataFrame(images, columns=color_features)
+                features.insert(0, "ID", range(identifier, identifier + len(images)))
+                features["LABEL"] = labels
+                features.to_csv(csv_file, header=False, index=False)
+                identifier += len(images)
     else:
         logger.info("Skip converting CIFAR as it is already present")
 
@@ -1,10 +1,11 @@
 """ Preprocessing steps for the DWTC dataset """
 import csv
+import re
 import requests
 from pathlib import Path
+from typing import IO, Iterator, List, Tuple
 from zipfile import ZipFile
 
-from scipy.io.arff import loadarff
 from sqlalchemy import create_engine
 
 from .generic import import_dataset
@@ -12,27 +13,50 @@ from .utils import download_archive
 from ..config import logger
 from ..models import Table
 
+# number of rows fetched from the sqlite database at once
+FETCH_SIZE = 1000
+# name of an @attribute: quoted with ' or " (may contain whitespace) or up to the next whitespace (space or tab)
+ATTRIBUTE_NAME = re.compile(r"""'((?:[^'\\]|\\.)*)'|"((?:[^"\\]|\\.)*)"|(\S+)""")
+
+
+def _read_arff(arff_file: IO) -> Tuple[List[str], Iterator[List[str]]]:
+    """
+    Minimal streaming parser for dense .arff files: returns the attribute names and an iterator over the data rows,
+    which are parsed line by line instead of loading the whole file.
+    """
+    attribute_names = []
+    for line in arff_file:
+        line = line.strip()
+        if not line or line.startswith("%"):
+            continue
+        keyword = line.split(maxsplit=1)[0].lower()
+        if keyword == "@attribute":
+            single_quoted, double_quoted, unquoted = ATTRIBUTE_NAME.match(line.split(maxsplit=1)[1]).groups()
+            attribute_names.append(next(name for name in (single_quoted, double_quoted, unquoted) if name is not None))
+        elif keyword == "@data":
+            break
+
+    data_lines = (line for line in map(str.strip, arff_file) if line and not line.startswith("%"))
+    return attribute_names, csv.reader(data_lines, quotechar="'", skipinitialspace=True)
+
 
 def _convert_dwtc_features(source: Path, to: Path) -> None:
     """ Convert the .arff feature file to csv """
     logger.info("Converting DWTC features")
     with source.open() as arff_file, to.open("w") as csv_file:
         csv_writer = csv.writer(csv_file)
-        data, metadata = loadarff(arff_file)
+        feature_names, rows = _read_arff(arff_file)
 
-        feature_names = list(data.dtype.names)
         if "ID" not in feature_names[0]:
             raise Exception(".arff malformed expected first column to be ID")
         feature_names[-1] = "LABEL"
         csv_writer.writerow(feature_names)
 
-        for entry in data:
-            entry = list(entry)
+        for entry in rows:
             # ensure ids are integer
-            entry[0] = int(entry[0])
-            if isinstance(entry[-1], bytes):
-                entry[-1] = entry[-1].decode()
-            csv_writer.writerow(entry)
+            entry[0] = int(float(entry[0]))
+            # missing values are marked with ? in .arff files
+            csv_writer.writerow("" if value == "?" else value for value in entry)
 
 
 def _convert_dwtc_data(source: Path, to: Path) -> None:
@@ -42,11 +66,14 @@ def _convert_dwtc_data(source: Path, to: Path) -> None:
 
     with ZipFile(to, "w") as zip_file:
         logger.info("Converting DWTC data")
-        for entry in cursor.fetchall():
-            identifier, content = entry[0], entry[7]
-            if not content:
-                content = ""
-            zip_file.writestr(f"{identifier}.raw", content)
+        # only FETCH_SIZE rows are in memory at any time
+        for entries in iter(lambda: cursor.fetchmany(FETCH_SIZE), []):
+            for entry in entries:
+                identifier, content = entry[0], entry[7]
+                if not content:
+                    content = ""
+                zip_file.writestr(f"{identifier}.raw", content)
+    cursor.close()
 
 
 def convert_dwtc(data_path: Path):
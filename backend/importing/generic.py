@@ -1,16 +1,181 @@
 import base64
+import itertools
 from pathlib import Path
 from tempfile import SpooledTemporaryFile
-from typing import IO, Type, Tuple
+from typing import IO, Type, Tuple, List, Iterable, Dict, Optional, Union, Mapping, Iterator
 from zipfile import ZipFile
 
 import numpy as np
 import pandas as pd
-from sqlalchemy import Text
+from psycopg2.extras import execute_values
 from sqlalchemy.orm.exc import NoResultFound
 
 from ..config import logger, db
 from ..models import Dataset, Sample, Label, Association, User
+from ..utils import FeatureStore, FeatureStoreWriter
+
+# number of samples written with one statement per table, and committed together
+IMPORT_BATCH_SIZE = 5000
+
+
+def _cursor():
+    """ Raw psycopg2 cursor inside the transaction of the session """
+    return db.connection().connection.cursor()
+
+
+def _insert_samples(dataset_id: int, sample_class: Type[Sample], features: List[str], contents: List) -> List[int]:
+    """ Bulk insert into `sample` and the table of the sample class, returns the new ids in the given order """
+    sample_type = sample_class.__mapper__.polymorphic_identity
+    contents = [sample_class.stored_content(content) for content in contents]
+
+    with _cursor() as cursor:
+        rows = execute_values(
+            cursor,
+            "INSERT INTO sample (dataset_id, features, type) VALUES %s RETURNING id",
+            [(dataset_id, sample_features, sample_type) for sample_features in features],
+            page_size=IMPORT_BATCH_SIZE,
+            fetch=True,
+        )
+        sample_ids = [sample_id for sample_id, in rows]
+        execute_values(
+            cursor,
+            f"INSERT INTO {sample_class.__tablename__} (id, {sample_class.content_column}) VALUES %s",
+            list(zip(sample_ids, contents)),
+            page_size=IMPORT_BATCH_SIZE,
+        )
+    return sample_ids
+
+
+def _insert_associations(associations: Iterable[Tuple[int, int, int]]) -> None:
+    """ Bulk insert of (sample_id, label_id, user_id) tuples """
+    with _cursor() as cursor:
+        execute_values(
+            cursor,
+            "INSERT INTO association (sample_id, label_id, user_id) VALUES %s",
+            list(associations),
+            page_size=IMPORT_BATCH_SIZE,
+        )
+
+
+class _ZipContents:
+    """ Contents stored as `{ID}.raw` members of a zip archive """
+
+    def __init__(self, zip_file: ZipFile):
+        self.zip_file = zip_file
+        self.members = {info.filename: info for info in zip_file.infolist()}
+
+    def __contains__(self, identifier) -> bool:
+        return f"{int(identifier)}.raw" in self.members
+
+    def read_order(self, identifiers: pd.Index) -> np.ndarray:
+        """ Read the members in the order they are stored in the archive, not in the order of the csv """
+        offsets = np.array([self.members[f"{int(identifier)}.raw"].header_offset for identifier in identifiers])
+        return np.argsort(offsets, kind="stable")
+
+    def read(self, identifier) -> Union[str, bytes]:
+        return self.zip_file.read(self.members[f"{int(identifier)}.raw"])
+
+
+class _MemoryContents:
+    """ Contents that are already in memory, by ID """
+
+    def __init__(self, contents: Union[Mapping, Iterable[Tuple[int, Union[str, bytes]]]]):
+        self.contents = dict(contents)
+
+    def __contains__(self, identifier) -> bool:
+        return identifier in self.contents
+
+    def read_order(self, identifiers: pd.Index) -> np.ndarray:
+        return np.arange(len(identifiers))
+
+    def read(self, identifier) -> Union[str, bytes]:
+        return self.contents[identifier]
+
+
+class _ChunkImporter:
+    """ Imports the samples of a features dataframe chunk by chunk, each chunk is written in bulk and committed """
+
+    def __init__(self, dataset: Dataset, sample_class: Type[Sample], contents: Union[_ZipContents, _MemoryContents],
+                 user: User, number_of_features: int, features_csv: IO):
+        self.dataset = dataset
+        self.sample_class = sample_class
+        self.user = user
+        self.contents = contents
+        self.label_ids: Dict = {}
+        self.number_of_imported = 0
+        self.feature_store: Optional[FeatureStoreWriter] = FeatureStore.writer(dataset.id, number_of_features)
+        # the imported features (without labels), row i belongs to the i-th sample id (see `FeatureStore.csv_path`)
+        self.features_csv = features_csv
+        self.features_csv_header = True
+
+    def _add_labels(self, label_names) -> None:
+        new_labels = [Label(name=str(label_name), dataset=self.dataset)
+                      for label_name in label_names if label_name not in self.label_ids]
+        if new_labels:
+            db.add_all(new_labels)
+            db.commit()
+            self.label_ids.update({label.name: label.id for label in new_labels})
+
+    def import_chunk(self, df: pd.DataFrame) -> None:
+        missing = [identifier for identifier in df.index if identifier not in self.contents]
+        for identifier in missing:
+            logger.error(f"Missing content of sample {identifier}, skipping sample")
+        df = df.drop(index=missing)
+        if df.empty:
+            return
+        df = df.iloc[self.contents.read_order(df.index)]
+        feature_df = df.drop(columns="LABEL")
+
+        labels = [str(label_name) if pd.notna(label_name) and label_name else None for label_name in df["LABEL"]]
+        self._add_labels(dict.fromkeys(label_name for label_name in labels if label_name is not None))
+
+        sample_ids = _insert_samples(
+            dataset_id=self.dataset.id,
+            sample_class=self.sample_class,
+            # serialise the features of all rows at once, one json object per row (same format as Series.to_json)
+            features=feature_df.to_json(orient="records", lines=True).splitlines(),
+            contents=[self.contents.read(identifier) for identifier in df.index],
+        )
+        _insert_associations(
+            (sample_id, self.label_ids[label_name], self.user.id)
+            for sample_id, label_name in zip(sample_ids, labels)
+            if label_name is not None
+        )
+        db.commit()
+
+        # same rows in the same order as the samples, so the csv stays aligned with the sample ids
+        feature_df.to_csv(self.features_csv, header=self.features_csv_header)
+        self.features_csv_header = False
+
+        if self.feature_store is not None:
+            try:
+                self.feature_store.append(sample_ids, feature_df.to_numpy(dtype=np.float32))
+            except ValueError as e:
+                logger.warning(f"Could not write feature store for {self.dataset}: {e}")
+                self.feature_store.abort()
+                self.feature_store = None
+
+        self.number_of_imported += len(sample_ids)
+        logger.info(f"{self.number_of_imported} samples of {self.dataset} imported")
+
+    def abort(self) -> None:
+        if self.feature_store is not None:
+            self.feature_store.abort()
+
+    def finish(self) -> None:
+        if self.feature_store is not None:
+            self.feature_store.close()
+        logger.info("Done importing dataset {}".format(self.dataset))
+
+
+def _default_user() -> User:
+    try:
+        return db.query(User).first()
+    except NoResultFound:
+        raise ValueError(
+            "To import a dataset, there must be at least one user in the system "
+            "(for creating the association between samples and labels)"
+        )
 
 
 def import_dataset(
@@ -21,22 +186,15 @@ def import_dataset(
     user: User = None,
     ensure_incomplete=False,
 ) -> Tuple[Dataset, int]:
+    """ Import a dataset from a features csv (columns ID, features..., LABEL) and a zip with the `{ID}.raw` contents """
     if not user:
-        try:
-            user = db.query(User).first()
-        except NoResultFound:
-            raise ValueError(
-                "To import a dataset, there must be at least one user in the system "
-                "(for creating the association between samples and labels)"
-            )
+        user = _default_user()
 
     if isinstance(features, Path):
         feature_file = features.open("r")
-        df = pd.read_csv(feature_file).set_index("ID")
-        feature_file.close()
     elif isinstance(features, SpooledTemporaryFile):
         features.rollover()
-        df = pd.read_csv(features._file).set_index("ID")
+        feature_file = features._file
     else:
         raise ValueError("The features argument must be either a Path or FileStorage")
 
@@ -49,72 +207,67 @@ def import_dataset(
     except AttributeError:
         raise ValueError("The content argument must be either a Path or FileStorage")
 
-    feature_df = df.drop(["LABEL"], axis=1)
+    try:
+        # the features are read in chunks, only one chunk of the csv is in memory at any time
+        # the label dtype is fixed, otherwise it is inferred per chunk (e.g. "1" and "1.0" if a chunk misses labels)
+        chunks = pd.read_csv(feature_file, chunksize=IMPORT_BATCH_SIZE, index_col="ID", dtype={"LABEL": str})
+        dataset = _import_chunks(name, sample_class, chunks, _ZipContents(zip_file), user)
+    finally:
+        if isinstance(features, Path):
+            feature_file.close()
 
-    dataset = Dataset(
-        name=name,
-        features=feature_df.to_csv(),
-        feature_names=",".join(feature_df.columns),
-    )
+    return _finish_import(dataset, ensure_incomplete)
 
-    all_labels = {
-        label_name: Label(name=str(label_name), dataset=dataset)
-        for label_name in df["LABEL"].unique()
-    }
-    db.add_all(all_labels.values())
-    db.commit()
 
-    total, samples, associations = len(df.index), [], []
-    # iterate over rows in dataframe (identifier = ID Column = index of row
-    for identifier, row in df.iterrows():
-        label_name = row["LABEL"]
-        content = zip_file.read(f"{int(identifier)}.raw")
-        sample = sample_class()
-        sample.dataset = dataset
-
-        # get features from dataframe (all columns expect ID and LABEL
-        sample_features = row.drop("LABEL")
-        # test if features exist for sample
-        if sample_features.empty:
-            logger.error(
-                f"Missing sample id in feature set: {identifier}, skipping sample"
-            )
-        else:
-            # save as json
-            sample.features = sample_features.to_json()
-            # get type of content and convert to text if needed
-            content_type = sample_class.content.property.columns[0].type
-            if isinstance(content_type, Text):
-                content = content.decode("utf-8")
-
-            sample.content = content
-            samples.append(sample)
-
-            if label_name and label_name in all_labels:
-                associations.append(
-                    Association(sample=sample, label=all_labels[label_name], user=user)
-                )
-
-        # save intermediate state
-        if identifier % 1000 == 0:
-            logger.info(
-                "{:.2f}% imported ({}/{})".format(
-                    (identifier / total) * 100, identifier, total
-                )
-            )
-            db.add_all(samples)
-            db.commit()
-            db.add_all(associations)
-            db.commit()
-            samples = []
-            associations = []
+def import_dataset_from_frames(
+    name: str,
+    sample_class: Type[Sample],
+    features_df: pd.DataFrame,
+    contents: Union[Mapping, Iterable[Tuple[int, Union[str, bytes]]]],
+    user: User = None,
+    ensure_incomplete=False,
+) -> Tuple[Dataset, int]:
+    """
+    Import a dataset that is already in memory, without writing and reading back a zip of the contents.
 
-    logger.info("Done importing dataset {}".format(dataset))
-    db.add_all(samples)
-    db.commit()
-    db.add_all(associations)
+    :param features_df:     features and LABEL column, indexed by ID (or with an ID column)
+    :param contents:        content per ID, as mapping or iterable of (ID, content) pairs
+    """
+    if not user:
+        user = _default_user()
+
+    if "ID" in features_df.columns:
+        features_df = features_df.set_index("ID")
+    chunks = (features_df.iloc[start:start + IMPORT_BATCH_SIZE]
+              for start in range(0, max(len(features_df.index), 1), IMPORT_BATCH_SIZE))
+    dataset = _import_chunks(name, sample_class, chunks, _MemoryContents(contents), user)
+    return _finish_import(dataset, ensure_incomplete)
+
+
+def _import_chunks(name: str, sample_class: Type[Sample], chunks: Iterator[pd.DataFrame],
+                   contents: Union[_ZipContents, _MemoryContents], user: User) -> Dataset:
+    first_chunk = next(chunks)
+    feature_names = first_chunk.columns.drop("LABEL")
+
+    dataset = Dataset(name=name, feature_names=",".join(feature_names))
+    db.add(dataset)
     db.commit()
 
+    FeatureStore.data_path.mkdir(parents=True, exist_ok=True)
+    with FeatureStore.csv_path(dataset.id).open("w") as csv_file:
+        importer = _ChunkImporter(dataset, sample_class, contents, user, number_of_features=len(feature_names),
+                                  features_csv=csv_file)
+        try:
+            for chunk in itertools.chain([first_chunk], chunks):
+                importer.import_chunk(chunk)
+        except BaseException:
+            importer.abort()
+            raise
+    importer.finish()
+    return dataset
+
+
+def _finish_import(dataset: Dataset, ensure_incomplete: bool) -> Tuple[Dataset, int]:
     number_of_samples = db.query(Sample).filter(Sample.dataset == dataset).count()
     if ensure_incomplete:
         number_of_associations = (
@@ -1,11 +1,11 @@
 """ Preprocessing steps for the Religions Texts dataset """
 import codecs
 from pathlib import Path
-from zipfile import ZipFile
+from typing import Iterator, Tuple
 
 import pandas as pd
 
-from .generic import import_dataset
+from .generic import import_dataset_from_frames
 from .utils import download_archive
 from ..config import logger
 from ..models import TextSample
@@ -27,17 +27,17 @@ def convert_religions_texts_features(source: Path, to: Path) -> None:
     features.to_csv(to, index_label="ID")
 
 
-def convert_religions_texts_data(source: Path, to: Path) -> None:
-    """ Convert the text file to a zip """
-    with ZipFile(to, "w") as zip_file, codecs.open(source, "r", "ISO-8859-1") as source_file:
-        logger.info("Converting Religions Texts data")
+def read_religions_texts_data(source: Path) -> Iterator[Tuple[int, str]]:
+    """ The texts of the text file with their ID """
+    with codecs.open(source, "r", "ISO-8859-1") as source_file:
+        logger.info("Reading Religions Texts data")
         identifier = 0
         for row in source_file:
             if is_number(row):
                 continue
             if not row:
                 row = ""
-            zip_file.writestr(f"{identifier}.raw", row)
+            yield identifier, row
             identifier += 1
 
 
@@ -57,19 +57,15 @@ def convert_religions_texts(data_path: Path):
         )
 
     target_csv_path = religions_texts_path / "religions_texts.csv"
-    target_zip_path = religions_texts_path / "religions_texts.zip"
 
     if not target_csv_path.exists():
         convert_religions_texts_features(source=feature_path, to=target_csv_path)
 
-    if not target_zip_path.exists():
-        convert_religions_texts_data(source=text_path, to=target_zip_path)
-
-    import_dataset(
+    import_dataset_from_frames(
         name="Religions Texts",
         sample_class=TextSample,
-        features=target_csv_path,
-        content=target_zip_path,
+        features_df=pd.read_csv(target_csv_path),
+        contents=read_religions_texts_data(text_path),
     )
 
 
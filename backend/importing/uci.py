@@ -8,15 +8,15 @@ from scipy.io.arff import loadarff
 from sqlalchemy import create_engine
 import pandas as pd
 
-from .generic import import_dataset
+from .generic import import_dataset_from_frames
 from .utils import download_archive
 from ..config import logger
 from ..models import TextSample
 
 
-def import_uci(uci_dataset_name: str, data_path: Path):
+def prepare_uci(data_path: Path) -> Path:
     """
-    Downloads uci dataset and transform to generic etikedi-input-format.
+    Downloads and extracts the uci datasets once, returns the directory with the extracted datasets.
     Might throw an exception at some point.
     """
     uci_path = data_path / "uci"
@@ -44,20 +44,22 @@ def import_uci(uci_dataset_name: str, data_path: Path):
         logger.info("Extracting zip file with uci datasets")
         uci_zip_handle.extractall(path=extracted_uci_datasets)
 
-    extracted_uci_datasets = extracted_uci_datasets / "uci"
+    return extracted_uci_datasets / "uci"
+
 
-    content_zip = str(extracted_uci_datasets / uci_dataset_name) + "_data.csv.zip"
+def import_uci(uci_dataset_name: str, data_path: Path):
+    """
+    Imports one of the uci datasets in the generic etikedi-input-format.
+    Might throw an exception at some point.
+    """
+    extracted_uci_datasets = prepare_uci(data_path)
 
     uci_df = pd.read_csv(str(extracted_uci_datasets / uci_dataset_name) + "_data.csv")
-    with ZipFile(content_zip, "w") as content_zip_file:
-        for _, row in uci_df.iterrows():
-            identifier = str(row["ID"])
-            content = str(row["content"])
-            content_zip_file.writestr(f"{identifier}.raw", content)
+    features_df = pd.read_csv(str(extracted_uci_datasets / uci_dataset_name) + "_features.csv")
 
-    import_dataset(
+    import_dataset_from_frames(
         name=uci_dataset_name,
         sample_class=TextSample,
-        features=Path(str(extracted_uci_datasets / uci_dataset_name) + "_features.csv"),
-        content=Path(str(extracted_uci_datasets / uci_dataset_name) + "_data.csv.zip"),
+        features_df=features_df,
+        contents=zip(uci_df["ID"], uci_df["content"].astype(str)),
     )
@@ -2,6 +2,7 @@ from .config import *
 from .dataset import *
 from .label import *
 from .association import *
+from .sample_label_state import *
 from .datatypes import *
 from .user import *
 from .labeling_function import *
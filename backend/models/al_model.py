@@ -112,6 +112,14 @@ class ALModel(str, Enum):
         elif self == ALModel.MLP:
             return MLPClassifier
 
+    def supports_partial_fit(self) -> bool:
+        """ Whether the model can be updated with new samples only (GaussianNB, MLPClassifier) """
+        return hasattr(self.get_class(), 'partial_fit')
+
+    def supports_warm_start(self) -> bool:
+        """ Whether refitting can reuse the previous solution (RandomForestClassifier, LogisticRegression, MLP) """
+        return 'warm_start' in self.get_class()().get_params()
+
 
 class StoppingCriteriaOption(str, Enum):
     ALL_LABELED = "all_labeled"
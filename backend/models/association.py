@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, ForeignKey, Boolean, Index, DDL, event
 from sqlalchemy.orm import relationship
 
 from . import LabelDTO
@@ -22,6 +22,16 @@ class Association(Base):
     is_current = Column(Boolean, default=True, server_default="true", nullable=False)
 
     __mapper_args__ = {"confirm_deleted_rows": False}
+    __table_args__ = (
+        # the lookups of (un)labeled samples only consider the current associations
+        Index("ix_association_current_sample_id", "sample_id", postgresql_where=is_current),
+    )
+
+
+# `create_all` does not add indices to existing tables, databases created before the index existed get it here
+event.listen(Base.metadata, "after_create", DDL("""
+    CREATE INDEX IF NOT EXISTS ix_association_current_sample_id ON association (sample_id) WHERE is_current;
+""").execute_if(dialect="postgresql"))
 
 
 class AssociationBase(BaseModel):
@@ -55,11 +55,13 @@ class Metric(BaseModel):
 
 # experiment specific
 class ExperimentResults(BaseModel):
-    # 3D data-frame: row = iteration, column = sample, value = tuple of confidence per class
-    # columns = SampleID
-    raw_predictions: pd.DataFrame
-    # columns = 0..n index of randomly generated samples
-    cb_predictions: pd.DataFrame
+    # float32 array: iteration x test sample x class, value = confidence of the class
+    # the test samples are in the order of test_sample_ids
+    raw_predictions: np.ndarray
+    # SampleID of each test sample (second axis of raw_predictions)
+    test_sample_ids: List[int]
+    # float32 array: iteration x randomly generated sample (in the order of the cb sample) x class
+    cb_predictions: np.ndarray
     # row = iteration, columns = list(MetricDFKeys)
     metric_scores: pd.DataFrame
     # A list of all SampleIDs that were initially labeled
@@ -82,11 +84,11 @@ class ExperimentResults(BaseModel):
                 raise ValueError("Dataframe should contain all keys as column")
         return metric_scores
 
-    @validator("raw_predictions")
-    def validate_raw_predictions(cls, raw_predictions):
-        if not all(isinstance(col, int) for col in raw_predictions.columns):
-            raise ValueError("All columns should be database-ids of samples.")
-        return raw_predictions
+    @validator("raw_predictions", "cb_predictions")
+    def validate_predictions(cls, predictions):
+        if predictions.ndim != 3:
+            raise ValueError("Predictions should be an array of iteration x sample x class.")
+        return predictions
 
     @root_validator()
     def validate_all(cls, values):
@@ -100,8 +102,14 @@ class ExperimentResults(BaseModel):
                 or len(cb_predictions) != len(metric_scores) \
                 or len(metric_scores) != len(meta_data):
             raise ValueError("Each item should contain all iterations.")
+        if 'test_sample_ids' in values and raw_predictions.shape[1] != len(values['test_sample_ids']):
+            raise ValueError("There should be one database-id for each test sample.")
         return values
 
+    def correct_class_idx(self) -> np.ndarray:
+        """ Index of the correct class of each test sample, in the order of test_sample_ids """
+        return np.array([self.correct_label_as_idx[sample_id] for sample_id in self.test_sample_ids], dtype=np.int64)
+
 
 class MetricsDFKeys(str, Enum):
     Acc = 'Acc',
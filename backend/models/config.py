@@ -44,8 +44,19 @@ class ActiveLearningConfig(BaseModel):
     # number of updates until next model training
     EVALUATION_SIZE: PositiveInt = 5
     COUNTER_UNTIL_NEXT_MODEL_UPDATE: PositiveInt = 5
+    # update the model with the newly labeled samples only, if AL_MODEL supports partial_fit or warm_start
+    INCREMENTAL_TRAINING: bool = False
+    # number of incremental updates until the model is refitted on all labeled samples again
+    FULL_REFIT_EVERY: PositiveInt = 10
     # Etikedi config options
     RANDOM_SAMPLE_EVERY: PositiveInt = 10
+    # number of ranked suggestions the backend keeps per dataset
+    SUGGESTION_BUFFER_SIZE: PositiveInt = 10
+    # new suggestions are requested in the background as soon as the buffer holds only this many
+    SUGGESTION_LOW_WATER_MARK: PositiveInt = 3
+    # seconds a suggested sample stays reserved for the user it was handed out to
+    SUGGESTION_LEASE_SECONDS: PositiveInt = 600
+    # minutes without requests until the AL worker of the dataset is stopped
     TIMEOUT_FOR_WORKER: PositiveInt = 60
 
     DATASET_NAME: str = "Dataset"
@@ -55,5 +66,11 @@ class ActiveLearningConfig(BaseModel):
     def validate_strategy_config(cls, config, values):
         return AlExperimentConfig.validate_strategy_config(config, values)
 
+    @validator('SUGGESTION_LOW_WATER_MARK')
+    def validate_low_water_mark(cls, low_water_mark, values):
+        if 'SUGGESTION_BUFFER_SIZE' in values and low_water_mark >= values['SUGGESTION_BUFFER_SIZE']:
+            raise ValueError("SUGGESTION_LOW_WATER_MARK has to be smaller than SUGGESTION_BUFFER_SIZE")
+        return low_water_mark
+
 
 default_al_config = ActiveLearningConfig()
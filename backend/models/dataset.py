@@ -2,7 +2,7 @@ import json
 from dataclasses import dataclass
 from typing import List, Optional
 from pydantic import BaseModel
-from sqlalchemy import Column, Text, String, Integer, JSON
+from sqlalchemy import Column, String, Integer, JSON
 from sqlalchemy.orm import relationship
 
 from . import default_al_config, ActiveLearningConfig
@@ -26,7 +26,7 @@ class Dataset(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(), unique=True, nullable=False)
     feature_names = Column(String(), nullable=True)
-    features = Column(Text(), nullable=True)
+    # the imported features are stored out of line, see `FeatureStore.csv_path`
     config = Column(
         JSON,
         nullable=True,
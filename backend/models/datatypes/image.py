@@ -1,7 +1,9 @@
-from sqlalchemy import Column, Integer, ForeignKey
-from sqlalchemy.dialects.postgresql import BYTEA
+from typing import Optional, Union
+
+from sqlalchemy import Column, Integer, ForeignKey, CHAR, DDL, event
 
 from .sample import Sample
+from ...config import Base, BlobStore
 
 
 class Image(Sample):
@@ -14,7 +16,8 @@ class Image(Sample):
 
     Furthermore, another entry will be created in the database table `Image`. Its id will reference
     (be the same) as the id of the entry in `Sample`. Its purpose is to save all information that
-    are specific to a sample of type `Image` (data).
+    are specific to a sample of type `Image` (data). The image data itself is kept in the `BlobStore`,
+    the table only references it by its hash.
 
     Examples:
         The constructor takes all keyword arguments of `Sample` in addition to `data`.
@@ -40,11 +43,11 @@ class Image(Sample):
         +----+-------------------------------------+------------+-------+
 
         Databaes table `Image`
-        +----+--------------------------------------------------------------------+
-        | id | content                                                            |
-        +====+====================================================================+
-        | 1  | 45,06 kB 00000000  53 51 4C 69 74 65 20 66 6F 72 6D 61 74 20 33 00 |
-        +----+--------------------------------------------------------------------+
+        +----+------------------------------------------------------------------+
+        | id | content_hash                                                     |
+        +====+==================================================================+
+        | 1  | 9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08 |
+        +----+------------------------------------------------------------------+
 
         After that, querying `Sample` will return objects of of this class.
 
@@ -55,12 +58,36 @@ class Image(Sample):
     __tablename__ = "image"
 
     id = Column(Integer, ForeignKey("sample.id"), primary_key=True)
-    content = Column(BYTEA)
+    content_hash = Column(CHAR(64))
 
     __mapper_args__ = {"polymorphic_identity": "image"}
 
+    content_column = "content_hash"
+
+    @property
+    def content(self) -> Optional[bytes]:
+        return BlobStore.get(self.content_hash) if self.content_hash else None
+
+    @content.setter
+    def content(self, data: bytes) -> None:
+        self.content_hash = BlobStore.put(data)
+
+    @staticmethod
+    def stored_content(content: Union[str, bytes]) -> str:
+        return BlobStore.put(content.encode("utf-8") if isinstance(content, str) else content)
+
+    def content_etag(self) -> str:
+        return self.content_hash
+
     def __str__(self):
         return 'Image {} in dataset "{}"'.format(self.id, self.dataset)
 
     def __repr__(self):
         return str(self)
+
+
+# `create_all` does not alter existing tables: image tables created before the blob store get the hash column here,
+# the contents are moved into the blob store by `migrate_image_contents`
+event.listen(Base.metadata, "after_create", DDL("""
+    ALTER TABLE image ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+""").execute_if(dialect="postgresql"))
@@ -1,15 +1,22 @@
 import base64
+import hashlib
 import json
 from typing import Union, Optional, List, Dict
 
 from pydantic import BaseModel, validator
-from sqlalchemy import ForeignKey, Column, Integer, VARCHAR, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import ForeignKey, Column, Integer, VARCHAR, Text, Index, Computed, DDL, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 
 from .. import AssociationCurrentLabel
 from ...config import Base
 
 
+# text search configuration of the stored search vectors, search queries have to use the same one
+SEARCH_CONFIGURATION = "english"
+SEARCH_VECTOR_EXPRESSION = "to_tsvector('{}', coalesce(content, ''))".format(SEARCH_CONFIGURATION)
+
+
 class Sample(Base):
     """
     Base class for samples.
@@ -47,10 +54,21 @@ class Sample(Base):
     type = Column(VARCHAR(10))
 
     content: Union[str, bytes]
+    # column of the table of the concrete sample class that stores the content
+    content_column = "content"
 
     __mapper_args__ = {"polymorphic_identity": "sample",
                        "polymorphic_on": "type"}
 
+    @staticmethod
+    def stored_content(content: Union[str, bytes]):
+        """ The value of `content_column` for the given content, text by default """
+        return content.decode("utf-8") if isinstance(content, bytes) else content
+
+    def content_etag(self) -> str:
+        content = self.content.encode("utf-8") if isinstance(self.content, str) else self.content
+        return hashlib.sha256(content or b"").hexdigest()
+
     def __str__(self):
         return "Sample {} in {}".format(self.id, self.dataset)
 
@@ -66,15 +84,22 @@ class Sample(Base):
         return list(self.feature_dict().values())
 
 
-class SampleDTO(BaseModel):
+# samples are always filtered by dataset and paged by id
+Index("ix_sample_dataset_id_id", Sample.dataset_id, Sample.id)
+
+
+class SampleBaseDTO(BaseModel):
     id: int
     dataset_id: int
     type: str
-    content: str
 
     class Config:
         orm_mode = True
 
+
+class SampleDTO(SampleBaseDTO):
+    content: str
+
     @validator("content", pre=True)
     def ensure_string_content(cls, content):
         """ Converts the content to a base64 encoded string if it is binary """
@@ -83,8 +108,17 @@ class SampleDTO(BaseModel):
         return content
 
 
-class SampleDTOwLabel(SampleDTO):
+class SampleDTOwLabel(SampleBaseDTO):
+    """ Sample in a list, without the content: it is loaded from `content_url` (GET /samples/{id}/content) """
+    content_url: Optional[str] = None
     associations: Optional[List[AssociationCurrentLabel]] = None
+    # only set for a free text search
+    rank: Optional[float] = None
+    snippet: Optional[str] = None
+
+    @validator("content_url", always=True)
+    def link_content(cls, content_url, values):
+        return content_url or "/samples/{}/content".format(values["id"])
 
     # only return current labels for filtered Samples, remove old labels
     @validator("associations")
@@ -99,3 +133,24 @@ class SampleDTOwLabel(SampleDTO):
 class UnlabelDTO(BaseModel):
     label_id: Optional[int]
     all: bool = False
+
+
+def search_vector_column():
+    """ tsvector of the `content` column, generated and stored by postgres whenever the content is written """
+    return deferred(Column(TSVECTOR, Computed(SEARCH_VECTOR_EXPRESSION, persisted=True)))
+
+
+def search_index(table_name: str, search_vector) -> Index:
+    """
+    GIN index on the search vector of a content table.
+
+    `create_all` does not alter existing tables, therefore databases created before the search vectors existed get
+    the column and the index after the next `create_all`.
+    """
+    index_name = "ix_{}_search_vector".format(table_name)
+    event.listen(Base.metadata, "after_create", DDL("""
+        ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS ({expression}) STORED;
+        CREATE INDEX IF NOT EXISTS {index} ON {table} USING gin (search_vector);
+    """.format(table=table_name, expression=SEARCH_VECTOR_EXPRESSION, index=index_name)).execute_if(dialect="postgresql"))
+    return Index(index_name, search_vector, postgresql_using="gin")
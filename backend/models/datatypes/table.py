@@ -1,6 +1,7 @@
 from sqlalchemy import Column, Integer, ForeignKey, Text
+from sqlalchemy.orm import deferred
 
-from .sample import Sample
+from .sample import Sample, search_vector_column, search_index
 
 
 class Table(Sample):
@@ -53,7 +54,10 @@ class Table(Sample):
     __tablename__ = "tables"
 
     id = Column(Integer, ForeignKey("sample.id"), primary_key=True)
-    content = Column(Text())
+    # deferred: only loaded when the content is accessed, not with every sample query
+    content = deferred(Column(Text()))
+    # full text search, see `utils.search`
+    search_vector = search_vector_column()
 
     __mapper_args__ = {"polymorphic_identity": "tables"}
 
@@ -62,3 +66,6 @@ class Table(Sample):
 
     def __repr__(self):
         return str(self)
+
+
+search_index(Table.__tablename__, Table.search_vector)
@@ -0,0 +1,61 @@
+from sqlalchemy import Column, Integer, ForeignKey, DDL, event
+
+from ..config import Base
+
+
+class SampleLabelState(Base):
+    """
+    Projection of the associations of a sample, maintained by a trigger on `association`.
+
+    Filtering samples by their label state only needs this table (primary key lookups) instead of aggregating the
+    whole `association` table. Samples that were never labeled have no row.
+    """
+    __tablename__ = "sample_label_state"
+
+    sample_id = Column(Integer, ForeignKey("sample.id", ondelete="CASCADE"), primary_key=True)
+    # number of all (current and outdated) associations
+    associations = Column(Integer, nullable=False, default=0)
+    current_labels = Column(Integer, nullable=False, default=0)
+
+
+# The trigger is (re)created after every `create_all`, so that existing databases get it as well. An empty projection
+# is filled from the existing associations once.
+create_label_state_trigger = DDL("""
+CREATE OR REPLACE FUNCTION update_sample_label_state() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO sample_label_state (sample_id, associations, current_labels)
+        VALUES (NEW.sample_id, 1, NEW.is_current::int)
+        ON CONFLICT (sample_id) DO UPDATE
+        SET associations = sample_label_state.associations + 1,
+            current_labels = sample_label_state.current_labels + NEW.is_current::int;
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE sample_label_state
+        SET associations = associations - 1, current_labels = current_labels - OLD.is_current::int
+        WHERE sample_id = OLD.sample_id;
+        INSERT INTO sample_label_state (sample_id, associations, current_labels)
+        VALUES (NEW.sample_id, 1, NEW.is_current::int)
+        ON CONFLICT (sample_id) DO UPDATE
+        SET associations = sample_label_state.associations + 1,
+            current_labels = sample_label_state.current_labels + NEW.is_current::int;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE sample_label_state
+        SET associations = associations - 1, current_labels = current_labels - OLD.is_current::int
+        WHERE sample_id = OLD.sample_id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS association_label_state ON association;
+CREATE TRIGGER association_label_state AFTER INSERT OR UPDATE OR DELETE ON association
+    FOR EACH ROW EXECUTE PROCEDURE update_sample_label_state();
+
+INSERT INTO sample_label_state (sample_id, associations, current_labels)
+SELECT sample_id, count(*), count(*) FILTER (WHERE is_current)
+FROM association
+WHERE NOT EXISTS (SELECT 1 FROM sample_label_state)
+GROUP BY sample_id;
+""")
+
+event.listen(Base.metadata, "after_create", create_label_state_trigger.execute_if(dialect="postgresql"))
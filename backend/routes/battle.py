@@ -1,12 +1,14 @@
 import concurrent.futures
 import json
-from typing import List, Dict, Union
+from typing import List, Dict, Union, Optional
 
-from fastapi import APIRouter, HTTPException, status, Query, Request
+from fastapi import APIRouter, HTTPException, status, Query, Request, Depends, Response
 from fastapi.responses import PlainTextResponse
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..battle_mode import BattleAnalyzer, BattleManager, plotting, Persistence
-from ..config import db, logger
+from ..config import db, logger, get_async_db
 from ..models import (
     Dataset,
     ALBattleConfig,
@@ -26,9 +28,10 @@ battle_router = APIRouter()
 
 
 @battle_router.get("/valid_strategies/{dataset_id}", response_model=ValidStrategiesReturnSchema)
-async def valid_strategies(dataset_id: int):
+async def valid_strategies(dataset_id: int, session: AsyncSession = Depends(get_async_db)):
     """Return all al-strategies and their configuration options that are applicable for this dataset."""
-    number_of_labels = db.query(Label).filter(Label.dataset_id == dataset_id).distinct(Label.name).count()
+    number_of_labels = await session.scalar(
+        select(func.count(Label.name.distinct())).where(Label.dataset_id == dataset_id))
     valid: List[QueryStrategyType] = list(
         filter(lambda strategy: number_of_labels == 2 or not strategy.only_binary_classification(), QueryStrategyType))
     return ValidStrategiesReturnSchema(
@@ -40,6 +43,8 @@ async def valid_strategies(dataset_id: int):
 async def start_battle(battle_config: ALBattleConfig, dataset_id: int):
     """Return the generated experiment-id."""
     _assert_dataset_exists(dataset_id)
+    # the ids of persisted experiments must not be given to new experiments
+    Persistence.restore_if_necessary()
     # start process
     try:
         experiment_id = BattleManager.create_and_start(dataset_id, battle_config)
@@ -161,14 +166,23 @@ async def get_metrics(experiment_id: int):
 
 
 @battle_router.get("/persisted", response_model=Union[Dict[int, BattleMetaPersistence], Dict[int, List]])
-async def get_persisted(by_dataset: bool = Query(default=False, alias='by-dataset')):
+async def get_persisted(
+        response: Response,
+        by_dataset: bool = Query(default=False, alias='by-dataset'),
+        offset: int = Query(default=0, ge=0),
+        limit: Optional[int] = Query(default=None, gt=0)):
     """
     Return meta-information about all experiments that are stored and can be loaded:
         Dict with experiment_id -> BattleMetaInformation.
     If by_dataset is true. the dict-keys are dataset_ids and the values are a list of all experiments for this dataset:
         Dict with dataset_id -> List[experiment_id -> BattleMetaInformation].
+    With offset and limit only a page of the experiments (ordered by experiment_id) is returned,
+    the total number of experiments is returned in the Header X-Total.
     """
-    persisted: Dict[int, BattleMetaPersistence] = Persistence.persisted_experiments
+    all_persisted: Dict[int, BattleMetaPersistence] = Persistence.get_storage_overview()
+    response.headers["X-Total"] = "{}".format(len(all_persisted))
+    page_ids = sorted(all_persisted)[offset:None if limit is None else offset + limit]
+    persisted = {exp_id: all_persisted[exp_id] for exp_id in page_ids}
     if not by_dataset:
         return persisted
     return _sort_by_dataset(persisted)
@@ -182,7 +196,7 @@ async def load_persisted(experiment_id: int):
     _assert_experiment_persisted(experiment_id)
     manager: BattleAnalyzer = Persistence.load_finished_experiments(experiment_id)
     BattleManager.set_finished_manager(manager)
-    return Persistence.persisted_experiments[experiment_id]
+    return Persistence.get_meta(experiment_id)
 
 
 @battle_router.post("/persisted/{experiment_id}")
@@ -220,7 +234,7 @@ def _assert_dataset_exists(dataset_id: int):
 
 
 def _assert_experiment_persisted(experiment_id: int):
-    if experiment_id not in Persistence.persisted_experiments:
+    if not Persistence.is_persisted(experiment_id):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail=f"Experiment {experiment_id} is not persisted.")
 
@@ -30,10 +30,13 @@ async def get_dataset_config(dataset_id: int, user: User = Depends(get_current_a
 
 
 @config_router.post("/", response_model=ActiveLearningConfig)
-async def change_dataset_config(dataset_id: int,
-                                config: ActiveLearningConfig,
-                                user: User = Depends(get_current_active_user)):
-    """ Update the configuration for the given dataset. Implies a restart of the AL process. Currently not working. """
+def change_dataset_config(dataset_id: int,
+                          config: ActiveLearningConfig,
+                          user: User = Depends(get_current_active_user)):
+    """
+    Update the configuration for the given dataset. Implies a restart of the AL process. Currently not working.
+    Not async: the restart waits for the old process, which must not block the event loop.
+    """
     if user.roles != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -52,6 +55,6 @@ async def change_dataset_config(dataset_id: int,
 
     worker = manager.get(dataset)
     if worker:
-        worker.restart_process()
+        worker.restart_process(dataset.get_config())
 
     return dataset.get_config()
@@ -1,31 +1,30 @@
-from typing import List, Optional, Union
+import time
+from typing import List, Optional, Union, Dict, Tuple
 
 from fastapi import Depends, UploadFile, File, Form, HTTPException, APIRouter, status, Query, Response
-from sqlalchemy import func, not_, select
-from sqlalchemy.orm import aliased
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, not_, exists, and_
+from sqlalchemy.orm import aliased, selectinload
 
-from ..config import db
+from ..config import db, BlobStore
 from ..importing.generic import import_dataset
-from ..models import DatasetStatistics, Dataset, DatasetDTO, User, Table, Image, Text, SampleDTO, Sample, Association, \
-    Label, SampleDTOwLabel
-from ..utils import number_of_labelled_samples, number_of_total_samples, number_of_features, get_current_active_user, \
-    get_current_active_admin
-from ..worker import manager
+from ..models import Dataset, DatasetDTO, User, Table, Image, Text, SampleDTO, Sample, Association, \
+    Label, SampleDTOwLabel, SampleLabelState, SEARCH_CONFIGURATION
+from ..utils import dataset_statistics, get_current_active_user, get_current_active_admin, FeatureStore, search_query
+from ..worker import manager, WorkerSnapshot
+from .samples import get_sample_dto_or_throw
 
 dataset_router = APIRouter()
 
 
 @dataset_router.get("", response_model=List[DatasetDTO])
 def get_datasets(user: User = Depends(get_current_active_user)):
-    datasets = db.query(Dataset).all()
+    # the labels are part of the response, load them for all datasets at once
+    datasets = db.query(Dataset).options(selectinload(Dataset.labels)).all()
 
+    statistics = dataset_statistics(datasets)
     for dataset in datasets:
-        dataset.statistics = DatasetStatistics(
-            total_samples=number_of_total_samples(dataset),
-            labelled_samples=number_of_labelled_samples(dataset),
-            features=number_of_features(dataset),
-            labels=len(dataset.labels)
-        )
+        dataset.statistics = statistics[dataset.id]
 
     return datasets
 
@@ -70,25 +69,31 @@ def delete_dataset(
 
     dataset = get_dataset_or_throw(dataset_id)
 
+    # the worker writes a snapshot when it stops, it has to be gone before the snapshot is deleted
+    manager.evict(dataset_id, wait=True)
+    content_hashes = [content_hash for content_hash, in
+                      db.query(Image.content_hash).select_from(Image).filter(Image.dataset_id == dataset_id).distinct()]
     db.delete(dataset)
+    db.flush()
+    # blobs are content-addressed, samples of other datasets might still reference the same ones
+    still_referenced = {content_hash for content_hash, in
+                        db.query(Image.content_hash).filter(Image.content_hash.in_(content_hashes)).distinct()}
     db.commit()
+    for content_hash in content_hashes:
+        if content_hash is not None and content_hash not in still_referenced:
+            BlobStore.delete(content_hash)
+    FeatureStore.delete(dataset_id)
+    WorkerSnapshot.delete(dataset_id)
     return dataset
 
 
 @dataset_router.get("/{dataset_id}/first_sample", response_model=SampleDTO)
-def get_first_sample(dataset_id: int, user: User = Depends(get_current_active_user)):
-    dataset = get_dataset_or_throw(dataset_id)
+async def get_first_sample(dataset_id: int, user: User = Depends(get_current_active_user)):
+    dataset = await run_in_threadpool(get_dataset_or_throw, dataset_id)
 
     worker = manager.get_or_else_load(dataset)
-    first_sample_id = worker.get_next_sample_id()
-    first_sample = db.get(Sample, first_sample_id)
-    if not first_sample:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="There was an error retrieving the first sample.",
-        )
-
-    return first_sample
+    first_sample_id = await worker.get_next_sample_id(user.id)
+    return await run_in_threadpool(get_sample_dto_or_throw, first_sample_id)
 
 
 @dataset_router.get("/{dataset_id}/samples/", response_model=List[SampleDTOwLabel])
@@ -97,6 +102,7 @@ def get_filtered_samples(
         dataset_id: int,
         page: Optional[int] = None,
         limit: Optional[int] = None,
+        after: Optional[int] = None,
         labels: Optional[List[int]] = Query(None),
         users: Optional[List[int]] = Query(None),
         labeled: Optional[bool] = None,
@@ -113,6 +119,8 @@ def get_filtered_samples(
     :param page:                number of page that should be fetched (beginning with 0) \\
 
     both limit and page need to be filled for paging, returns Total number of elements in the Header in X-Total \\
+    :param after:               cursor for keyset paging instead of page: return the samples after this sample id,\\
+                                the cursor of the next page is returned in the Header X-Next-Cursor \\
 
     :param labeled:             return only labeled samples (true) / unlabeled samples (false)\\
     :param labels:              list of label_ids to filter for add each label with label = label_id\\
@@ -120,7 +128,9 @@ def get_filtered_samples(
 
     :param users:               list of user_ids to filter for add each user with users = user_id\\
 
-    :param free_text:           freetext search (only one word)\\
+    :param free_text:           freetext search: all words have to match, supports "phrases", prefix*, -exclusion\\
+                                and OR. Results are ordered by rank (except for cursor paging) and contain a\\
+                                snippet with the highlighted matches\\
 
     :param user:                the currently active user -> needed for authentication-check\\
     :return:                    list of samples
@@ -160,38 +170,42 @@ def get_filtered_samples(
         query = query.filter(Association.user_id.in_(users))
 
     # filter for only labeled or unlabeled datasets
+    has_associations = exists().where(and_(SampleLabelState.sample_id == Sample.id,
+                                           SampleLabelState.associations > 0))
     if labeled is not None:
         if labeled:
-            if not (labels or users):
-                query = query.join(Association, Sample.id == Association.sample_id)
+            query = query.filter(has_associations)
         else:
             if users or labels or divided_labels:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Cannot process unlabeled Samples if filters for Labels or Users are set.",
                 )
-            query = query.filter(Sample.dataset_id == dataset_id, ~Sample.associations.any())
+            query = query.filter(~has_associations)
 
-    # text search
+    # full text search on the stored search vectors of the content
+    search = None
     if free_text:
-        # prepare text
-        free_text = free_text.replace(" ", " & ")
-
-        sample = db.query(Sample).filter(Sample.dataset_id == dataset_id).first()
-        content_type = sample.type
+        # all samples of a dataset have the same type, so one sample is enough
+        sample_type = db.query(Sample.type).filter(Sample.dataset_id == dataset_id).limit(1).scalar()
+        sample_mapper = Sample.__mapper__.polymorphic_map.get(sample_type)
+        content_table = sample_mapper.local_table if sample_mapper is not None else None
 
         # text search only for content type 'text' and 'table'
-        if content_type == "text":
-            matched_tables = select([Text.id]).where(Text.content.match('{}'.format(free_text)))
-            query = query.join(Text).filter(Text.id.in_(matched_tables))
-        elif content_type == "table":
-            matched_tables = select([Table.id]).where(Table.content.match('{}'.format(free_text)))
-            query = query.join(Table).filter(Table.id.in_(matched_tables))
-        else:
+        if content_table is None or "search_vector" not in content_table.c:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="The Dataset with id {} does not have text to search as content.".format(dataset_id),
             )
+        ts_query = search_query(free_text)
+        if ts_query is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="The search text does not contain any word.",
+            )
+        query = query.join(content_table, content_table.c.id == Sample.id) \
+            .filter(content_table.c.search_vector.op("@@")(ts_query))
+        search = (content_table, ts_query)
 
     # filter for divided labels (sample has more than 1 label)
     if divided_labels:
@@ -216,22 +230,33 @@ def get_filtered_samples(
             .group_by(Sample.id).having(func.count(association1.label_id) > 1) \
             .order_by(func.count(association1.label_id).desc())
 
-    # only return samples with no label or a current label
-    # All Samples with a current label
-    with_current_association = db.query(Sample.id)\
-        .join(Association, Sample.id == Association.sample_id)\
-        .filter(Association.is_current == only_current_associations)
-    # All Samples with a label
-    with_association = db.query(Sample.id)\
-        .join(Association, Sample.id == Association.sample_id)\
-        .subquery()
-    # All Samples without any labels
-    without_association = db.query(Sample.id)\
-        .filter(Sample.id.notin_(with_association))
+    # only return samples with no label or a current label, i.e. not those whose labels are all outdated
+    only_outdated_labels = exists().where(and_(SampleLabelState.sample_id == Sample.id,
+                                               SampleLabelState.associations > 0,
+                                               SampleLabelState.current_labels == 0))
+    query = query.filter(~only_outdated_labels)
 
-    valid_samples = with_current_association.union(without_association)
-
-    query = query.filter(Sample.id.in_(valid_samples))
+    if after is not None:
+        if divided_labels:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cursor paging is not possible for divided labels, use page instead.",
+            )
+        # keyset paging: no matter how deep the page is, only `limit` rows of the primary key index are read
+        query = query.filter(Sample.id > after).order_by(Sample.id)
+        if limit:
+            query = query.limit(limit)
+        samples = query.all()
+        if limit and len(samples) == limit:
+            response.headers["X-Next-Cursor"] = "{}".format(samples[-1].id)
+        if search:
+            add_search_results(samples, *search)
+        return samples
+
+    order = [Sample.id]
+    if search and not divided_labels:
+        content_table, ts_query = search
+        order.insert(0, func.ts_rank(content_table.c.search_vector, ts_query).desc())
 
     # limit number of returned elements and paging, return total_elements in header
     if page is not None and limit:
@@ -241,16 +266,59 @@ def get_filtered_samples(
                 detail="Page number needs to be 0 or greater. Page number was: {}.".format(page),
             )
 
-        total_elements = query.count()
-        response.headers["X-Total"] = "{}".format(total_elements)
+        response.headers["X-Total"] = "{}".format(cached_count(query))
         lower_limit = page * limit
         upper_limit = page * limit + limit
-        query = query.order_by(Sample.id).slice(lower_limit, upper_limit)
+        query = query.order_by(*order).slice(lower_limit, upper_limit)
+    elif search and not divided_labels:
+        query = query.order_by(*order)
 
     samples = query.all()
+    if search:
+        add_search_results(samples, *search)
     return samples
 
 
+# highlighted fragments of the content that are returned as snippet of a found sample
+SEARCH_HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=20, MinWords=5, MaxFragments=3"
+
+
+def add_search_results(samples: List[Sample], content_table, ts_query) -> None:
+    """ Sets `rank` and `snippet` of the found samples, the (expensive) snippets are only built for returned samples """
+    if not samples:
+        return
+    # html tags (of tables) are no words and should not be part of the snippet
+    plain_content = func.regexp_replace(content_table.c.content, "<[^>]*>", " ", "g")
+    rows = db.query(content_table.c.id,
+                    func.ts_rank(content_table.c.search_vector, ts_query),
+                    func.ts_headline(SEARCH_CONFIGURATION, plain_content, ts_query, SEARCH_HEADLINE_OPTIONS)) \
+        .filter(content_table.c.id.in_([sample.id for sample in samples]))
+    results = {sample_id: (rank, snippet) for sample_id, rank, snippet in rows}
+    for sample in samples:
+        sample.rank, sample.snippet = results.get(sample.id, (None, None))
+
+
+# seconds a counted number of filtered samples is reused, X-Total only has to be approximately right while paging
+TOTAL_COUNT_TTL = 30
+_total_counts: Dict[str, Tuple[float, int]] = {}
+
+
+def cached_count(query) -> int:
+    """ `query.count()`, cached per (compiled) query for TOTAL_COUNT_TTL seconds """
+    statement = query.statement.compile()
+    key = str(statement) + repr(sorted(statement.params.items()))
+    now = time.monotonic()
+    cached = _total_counts.get(key)
+    if cached is not None and now - cached[0] < TOTAL_COUNT_TTL:
+        return cached[1]
+
+    if len(_total_counts) > 1000:  # only a few filters are used at the same time
+        _total_counts.clear()
+    count = query.count()
+    _total_counts[key] = (now, count)
+    return count
+
+
 @dataset_router.get('/{dataset_id}/metrics/')
 def get_worker_metrics(dataset_id: int, user=Depends(get_current_active_user)):
     """
@@ -2,9 +2,11 @@ import re
 from typing import List
 from traceback import format_exc
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, status, Depends
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..config import db
+from ..config import db, get_async_db
 from ..models import LabelingFunction, LabelingFunctionDTO, SampleDTO, Sample, TestRunResponse, LabelDTO
 from sqlalchemy.sql.expression import func
 
@@ -12,10 +14,11 @@ labeling_functions_router = APIRouter()
 
 
 @labeling_functions_router.get("/", response_model=List[LabelingFunctionDTO])
-async def get_dataset_labeling_functions(dataset_id: int):
+async def get_dataset_labeling_functions(dataset_id: int, session: AsyncSession = Depends(get_async_db)):
     """Return the functions used for automatic labeling for the given dataset."""
 
-    labeling_functions = db.query(LabelingFunction).filter(LabelingFunction.dataset_id == dataset_id).all()
+    result = await session.execute(select(LabelingFunction).where(LabelingFunction.dataset_id == dataset_id))
+    labeling_functions = result.scalars().all()
 
     if labeling_functions is None:
         raise HTTPException(
@@ -1,9 +1,11 @@
 from typing import List
 
 from fastapi import HTTPException, APIRouter, Depends
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
-from ..config import db
+from ..config import db, get_async_db
 from ..models import Label, CreateLabelDTO, LabelDTO, User
 from ..utils import get_current_active_user
 
@@ -11,14 +13,17 @@ label_router = APIRouter()
 
 
 @label_router.get("/", response_model=List[LabelDTO])
-async def get_labels(dataset_id: int, user: User = Depends(get_current_active_user)):
+async def get_labels(dataset_id: int, user: User = Depends(get_current_active_user),
+                     session: AsyncSession = Depends(get_async_db)):
     """
     This function responds to a request for /api/int:dataset_id/labels
     with the complete lists of data sets
 
     :return:        json string of list of labels for a data set
     """
-    labels = db.query(Label).filter(Label.dataset_id == dataset_id)
+    # only the columns of the DTO, a label would eagerly load all of its samples
+    result = await session.execute(select(Label.id, Label.name).where(Label.dataset_id == dataset_id))
+    labels = result.mappings().all()
 
     if labels is None:
         raise HTTPException(
@@ -26,7 +31,7 @@ async def get_labels(dataset_id: int, user: User = Depends(get_current_active_us
             detail="Labels not found for data set: {}".format(dataset_id),
         )
 
-    return list(labels)
+    return labels
 
 
 @label_router.post("/", response_model=LabelDTO)
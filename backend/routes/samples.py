@@ -1,8 +1,12 @@
-from fastapi import status, APIRouter, HTTPException, Depends
+from typing import Optional
+
+from fastapi import status, APIRouter, HTTPException, Depends, Header, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
 from sqlalchemy.exc import IntegrityError
 
-from ..config import db, SQLAlchemyError
-from ..models import Sample, SampleDTO, User, UnlabelDTO, Label, Association, Dataset
+from ..config import db, SQLAlchemyError, BlobStore
+from ..models import Sample, SampleDTO, User, UnlabelDTO, Label, Association, Dataset, Image
 from ..utils import can_assign, get_current_active_user, get_current_active_admin
 from ..worker import manager
 
@@ -21,16 +25,70 @@ def get_sample(sample_id: int, user: User = Depends(get_current_active_user)):
     return sample
 
 
+# magic numbers of the image formats browsers display
+IMAGE_SIGNATURES = {
+    b"\x89PNG": "image/png",
+    b"\xff\xd8\xff": "image/jpeg",
+    b"GIF8": "image/gif",
+}
+
+
+def image_media_type(header: bytes) -> str:
+    for signature, media_type in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return media_type
+    return "application/octet-stream"
+
+
+@sample_router.get("/{sample_id}/content")
+def get_sample_content(sample_id: int, if_none_match: Optional[str] = Header(None),
+                       user: User = Depends(get_current_active_user)):
+    """
+    The raw content of a sample. Images are streamed from the blob store, the ETag allows clients to cache contents.
+    """
+    sample = db.query(Sample).filter_by(id=sample_id).first()
+    if sample is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Sample not found for id: {}.".format(sample_id),
+        )
+
+    etag = '"{}"'.format(sample.content_etag())
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if isinstance(sample, Image):
+        path = BlobStore.path(sample.content_hash)
+        with path.open("rb") as file:
+            media_type = image_media_type(file.read(8))
+        return FileResponse(path, media_type=media_type, headers=headers)
+    return Response(content=sample.content, media_type="text/plain; charset=utf-8", headers=headers)
+
+
 @sample_router.post("/{sample_id}", response_model=SampleDTO)
-def post_sample(sample_id: int, label_id: int, user: User = Depends(get_current_active_user)):
+async def post_sample(sample_id: int, label_id: int, user: User = Depends(get_current_active_user)):
     """
     Associate a sample with a label and return the next label.
 
+    The database work runs in the threadpool, waiting for the next suggestion of the AL worker does not block a thread.
+
     :param sample_id:   ID of data sample to find
     :param label_id:    ID of the label
     :param user:        Current user Object
     :return:            data set matching ID
     """
+    dataset = await run_in_threadpool(_associate, sample_id, label_id, user)
+
+    # Retrieve pipe endpoint for process with corresponding dataset_id and send new label
+    worker = manager.get_or_else_load(dataset)
+    worker.add_sample_label(sample_id=sample_id, label_id=label_id)
+
+    next_sample_id = await worker.get_next_sample_id(user.id)
+    return await run_in_threadpool(get_sample_dto_or_throw, next_sample_id)
+
+
+def _associate(sample_id: int, label_id: int, user: User) -> Dataset:
     if not can_assign(sample_id, label_id):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -46,20 +104,18 @@ def post_sample(sample_id: int, label_id: int, user: User = Depends(get_current_
     except IntegrityError:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT)
 
-    # Retrieve pipe endpoint for process with corresponding dataset_id and send new label
-    dataset = db.query(Sample).get(sample_id).dataset
+    return db.query(Sample).get(sample_id).dataset
 
-    worker = manager.get_or_else_load(dataset)
-    worker.add_sample_label(sample_id=sample_id)
 
-    next_sample_id = worker.get_next_sample_id()
-    next_sample = db.get(Sample, next_sample_id)
-    if not next_sample:
+def get_sample_dto_or_throw(sample_id: int) -> SampleDTO:
+    """ Load a suggested sample, converted to its DTO while still in the threadpool """
+    sample = db.get(Sample, sample_id)
+    if not sample:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="There was an error retrieving the next sample.",
         )
-    return next_sample
+    return SampleDTO.from_orm(sample)
 
 
 @sample_router.delete("/{sample_id}", response_model=None)
@@ -132,7 +132,7 @@ def test_start(complete_battle):
     if battle_config.TRAIN_TEST_SPLIT * len(samples_df) > len(all_labels):
         # assert correctly traint split ratio
         test_sample_size = abs(battle_config.TRAIN_TEST_SPLIT * len(samples_df))
-        assert (test_sample_size - len(results.raw_predictions.columns) < 5)
+        assert (test_sample_size - len(results.test_sample_ids) < 5)
     _assert_meta_data(all_sample_ids, total_time_measured, battle_config, results)
     # model classes should be all label in the dataset
     assert set(all_labels) == set(results.classes)
@@ -151,9 +151,12 @@ def _assert_finished_successfully(events: List[ExperimentQueueEvent], config: AL
 
 def _assert_correct_ids(all_sample_ids, test_cb_sample, results: ExperimentResults):
     # all ids of test samples should be in the original dataset
-    assert all(smpl in all_sample_ids for smpl in results.raw_predictions.columns)  # subset
+    assert all(smpl in all_sample_ids for smpl in results.test_sample_ids)  # subset
+    # one prediction per iteration, test sample and class
+    assert results.raw_predictions.dtype == np.float32
+    assert results.raw_predictions.shape == (len(results.meta_data), len(results.test_sample_ids), len(results.classes))
     # the provided cb_sample are used
-    assert set(results.cb_predictions.columns.array) == set(test_cb_sample.index)
+    assert results.cb_predictions.shape[1] == len(test_cb_sample)
     # correct_label_as_idx
     for db_id, index_of_class in results.correct_label_as_idx.items():
         assert db_id in all_sample_ids
@@ -170,5 +173,5 @@ def _assert_meta_data(all_sample_ids, total_time_measured, battle_config, result
     if battle_config.STOPPING_CRITERIA == StoppingCriteriaOption.ALL_LABELED:
         assert math.isclose(results.meta_data[-1].percentage_labeled, 1.0, abs_tol=0.001)
         # all samples that are not in the test == all samples that were initially labeled and labeled in the process
-        assert (set(all_sample_ids).difference(set(results.raw_predictions.columns))
+        assert (set(all_sample_ids).difference(set(results.test_sample_ids))
                 == set(list(np.concatenate([m.sample_ids for m in results.meta_data])) + results.initially_labeled))
@@ -0,0 +1,27 @@
+import numpy as np
+from sklearn.metrics import accuracy_score, f1_score, recall_score, precision_score, auc
+
+from ...battle_mode.metrics import classification_scores, normalised_auc
+
+
+def test_scores_match_sklearn():
+    rng = np.random.default_rng(0)
+    # the last class is never correct, the predictions of the first iterations miss classes as well
+    true_idx = rng.integers(0, 3, size=50)
+    predicted_idx = rng.integers(0, 4, size=(6, 50))
+    predicted_idx[0] = 0
+    predicted_idx[1, :25] = 1
+
+    scores = classification_scores(true_idx, predicted_idx, number_of_classes=4)
+    for iteration, y_pred in enumerate(predicted_idx):
+        assert np.isclose(scores.accuracy[iteration], accuracy_score(true_idx, y_pred))
+        for metric, values in ((f1_score, scores.f1), (recall_score, scores.recall),
+                               (precision_score, scores.precision)):
+            assert np.isclose(values[iteration], metric(true_idx, y_pred, average='macro', zero_division=0))
+
+
+def test_normalised_auc():
+    values = np.array([0.2, 0.5, 0.4, 0.9])
+    expected = [0.0] + [auc(list(range(idx + 1)), values[:idx + 1]) / idx for idx in range(1, len(values))]
+    assert np.allclose(normalised_auc(values), expected)
+    assert len(normalised_auc(np.array([]))) == 0
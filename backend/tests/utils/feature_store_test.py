@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from ...utils import FeatureStore, FeatureStoreWriter
+
+
+@pytest.fixture(autouse=True)
+def feature_store_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(FeatureStore, 'data_path', tmp_path)
+    yield tmp_path
+
+
+def test_write_and_load():
+    sample_ids = [7, 3, 5]
+    features = np.array([[7, 70], [3, 30], [5, 50]])
+    FeatureStore.write(1, sample_ids, features)
+
+    stored = FeatureStore.load(1)
+    # rows are sorted by sample id and memory-mapped
+    assert list(stored.ids) == [3, 5, 7]
+    assert isinstance(stored.matrix, np.memmap)
+    assert stored.matrix.dtype == np.float32
+    assert stored.row_index == {3: 0, 5: 1, 7: 2}
+    assert stored.features_of([5, 7]).tolist() == [[5, 50], [7, 70]]
+
+
+def test_unknown_sample():
+    FeatureStore.write(1, [1, 2], np.zeros((2, 3)))
+    with pytest.raises(KeyError):
+        FeatureStore.load(1).features_of([3])
+
+
+def test_delete():
+    FeatureStore.write(1, [1], np.zeros((1, 1)))
+    assert FeatureStore.exists(1)
+    FeatureStore.delete(1)
+    assert not FeatureStore.exists(1)
+
+
+def test_writer_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(FeatureStoreWriter, 'copy_batch_size', 2)
+    with FeatureStore.writer(1, number_of_features=2) as writer:
+        writer.append([9, 4], np.array([[9, 90], [4, 40]]))
+        writer.append([6], np.array([[6, 60]]))
+
+    stored = FeatureStore.load(1)
+    assert list(stored.ids) == [4, 6, 9]
+    assert stored.matrix.tolist() == [[4, 40], [6, 60], [9, 90]]
+    assert not list(tmp_path.glob('*.raw'))
+
+
+def test_writer_aborts_on_error():
+    with pytest.raises(ValueError):
+        with FeatureStore.writer(1, number_of_features=2) as writer:
+            writer.append([1], np.zeros((1, 3)))
+    assert not FeatureStore.exists(1)
+
+
+def test_import_legacy_csv(feature_store_path):
+    FeatureStore.import_legacy_csv(4, "ID,a,b\n0,1.5,2\n1,3,4\n", sample_ids=[12, 11])
+
+    assert FeatureStore.csv_path(4).exists()
+    stored = FeatureStore.load(4)
+    # the csv rows belong to the samples in the order of their ids
+    assert stored.features_of([11, 12]).tolist() == [[1.5, 2], [3, 4]]
@@ -0,0 +1,12 @@
+from ...utils import parse_search_query
+
+
+def test_words_phrases_and_prefixes():
+    assert parse_search_query('machine learning') == 'machine & learning'
+    assert parse_search_query('"machine learning" tab*') == 'machine <-> learning & tab:*'
+    assert parse_search_query('-image OR picture') == '!image | picture'
+
+
+def test_special_characters_are_no_operators():
+    assert parse_search_query("a&b | c:* ('d')") == 'a <-> b & c:* & d'
+    assert parse_search_query('& | !') is None
@@ -7,6 +7,9 @@ from .dataset import *
 from .labels import *
 from .users import *
 from .exceptions import *
+from .feature_store import *
+from .search import *
+from .migrations import *
 
 
 def timeit(func):
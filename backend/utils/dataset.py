@@ -1,5 +1,9 @@
+from typing import Dict, List
+
+from sqlalchemy import func, and_
+
 from ..config import db
-from ..models import Dataset, Association, Sample
+from ..models import Dataset, DatasetStatistics, Sample, SampleLabelState
 
 
 def number_of_total_samples(dataset: Dataset) -> int:
@@ -7,10 +11,36 @@ def number_of_total_samples(dataset: Dataset) -> int:
 
 
 def number_of_labelled_samples(dataset: Dataset) -> int:
-    return db.query(Association).join(Association.sample) \
+    """ Samples with at least one current label, a sample labelled by several users is counted once """
+    return db.query(SampleLabelState).join(Sample, Sample.id == SampleLabelState.sample_id) \
         .filter(Sample.dataset == dataset) \
+        .filter(SampleLabelState.current_labels > 0) \
         .count()
 
 
 def number_of_features(dataset: Dataset) -> int:
-    return len(dataset.feature_names.split(','))
\ No newline at end of file
+    return len(dataset.feature_names.split(','))
+
+
+def dataset_statistics(datasets: List[Dataset]) -> Dict[int, DatasetStatistics]:
+    """
+    Statistics of all given datasets, counted with one aggregated query (using the label state projection instead
+    of the associations). The labels of the datasets should already be loaded, e.g. with `selectinload`.
+    """
+    has_current_label = and_(SampleLabelState.sample_id == Sample.id, SampleLabelState.current_labels > 0)
+    counts = db.query(Sample.dataset_id, func.count(Sample.id), func.count(SampleLabelState.sample_id)) \
+        .outerjoin(SampleLabelState, has_current_label) \
+        .filter(Sample.dataset_id.in_([dataset.id for dataset in datasets])) \
+        .group_by(Sample.dataset_id)
+    sample_counts = {dataset_id: (total, labelled) for dataset_id, total, labelled in counts}
+
+    statistics = {}
+    for dataset in datasets:
+        total, labelled = sample_counts.get(dataset.id, (0, 0))
+        statistics[dataset.id] = DatasetStatistics(
+            total_samples=total,
+            labelled_samples=labelled,
+            features=number_of_features(dataset),
+            labels=len(dataset.labels)
+        )
+    return statistics
@@ -0,0 +1,235 @@
+import json
+from dataclasses import dataclass
+from io import StringIO
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from sqlalchemy import inspect, text
+
+from ..config import db, logger, DATA_PATH
+from ..models import Sample
+
+
+@dataclass
+class FeatureMatrix:
+    """
+    The features of all samples of a dataset as one dense float32 matrix.
+
+    Row `i` of `matrix` belongs to the sample with the database id `ids[i]`. The rows are sorted by
+    the sample id, so the row of a sample can be looked up with a binary search as well.
+    """
+    ids: np.ndarray
+    matrix: np.ndarray
+
+    def __post_init__(self):
+        self._row_index: Optional[Dict[int, int]] = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def row_index(self) -> Dict[int, int]:
+        """ SampleID -> row in `matrix` """
+        if self._row_index is None:
+            self._row_index = {int(sample_id): row for row, sample_id in enumerate(self.ids)}
+        return self._row_index
+
+    def rows(self, sample_ids: Iterable[int]) -> np.ndarray:
+        """ Positions of the given samples in `matrix`, in the given order """
+        sample_ids = np.fromiter(sample_ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, sample_ids)
+        if len(sample_ids) and (positions.max() >= len(self.ids) or np.any(self.ids[positions] != sample_ids)):
+            raise KeyError("Some samples are not part of the feature store")
+        return positions
+
+    def features_of(self, sample_ids: Iterable[int]) -> np.ndarray:
+        return self.matrix[self.rows(sample_ids)]
+
+
+class FeatureStoreWriter:
+    """
+    Writes the feature matrix of a dataset batch by batch, so that it never has to be in memory completely.
+
+    The rows are appended to raw temporary files and converted into the `.npy` files of the store (sorted by
+    sample id, see `FeatureMatrix`) on `close`. Used as context manager, nothing is written if an exception occurs.
+    """
+    # number of rows copied at once while converting
+    copy_batch_size = 65536
+
+    def __init__(self, dataset_id: int, number_of_features: int):
+        self.dataset_id = dataset_id
+        self.number_of_features = number_of_features
+        self.number_of_rows = 0
+        FeatureStore.data_path.mkdir(parents=True, exist_ok=True)
+        self.ids_path, self.features_path = FeatureStore._paths(dataset_id)
+        self.raw_ids_path = self.ids_path.with_suffix('.raw')
+        self.raw_features_path = self.features_path.with_suffix('.raw')
+        self.raw_ids = self.raw_ids_path.open('wb')
+        self.raw_features = self.raw_features_path.open('wb')
+
+    def __enter__(self) -> 'FeatureStoreWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def append(self, sample_ids: Iterable[int], features: np.ndarray) -> None:
+        """ `features[i]` has to belong to `sample_ids[i]` """
+        sample_ids = np.asarray(list(sample_ids), dtype=np.int64)
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        if len(sample_ids) != len(features) or (len(features) and features.shape[1] != self.number_of_features):
+            raise ValueError("There has to be exactly one feature row of the right length for each sample")
+        self.raw_ids.write(sample_ids.tobytes())
+        self.raw_features.write(features.tobytes())
+        self.number_of_rows += len(sample_ids)
+
+    def close(self) -> None:
+        self.raw_ids.close()
+        self.raw_features.close()
+        try:
+            shape = (self.number_of_rows, self.number_of_features)
+            raw_ids = np.fromfile(self.raw_ids_path, dtype=np.int64)
+            raw_features = np.memmap(self.raw_features_path, dtype=np.float32, mode='r', shape=shape) \
+                if self.number_of_rows else np.empty(shape, dtype=np.float32)
+            order = np.argsort(raw_ids, kind='stable')
+            already_sorted = np.array_equal(order, np.arange(len(order)))
+
+            # write to temporary files first, readers should never see a half written matrix
+            tmp_ids_path, tmp_features_path = self.ids_path.with_suffix('.tmp'), self.features_path.with_suffix('.tmp')
+            with tmp_ids_path.open('wb') as file:
+                np.save(file, raw_ids[order])
+            features = open_memmap(tmp_features_path, mode='w+', dtype=np.float32, shape=shape)
+            for start in range(0, self.number_of_rows, self.copy_batch_size):
+                stop = start + self.copy_batch_size
+                features[start:stop] = raw_features[start:stop] if already_sorted else raw_features[order[start:stop]]
+            features.flush()
+            del features, raw_features
+
+            tmp_ids_path.replace(self.ids_path)
+            tmp_features_path.replace(self.features_path)
+        finally:
+            self._remove_raw_files()
+
+    def abort(self) -> None:
+        self.raw_ids.close()
+        self.raw_features.close()
+        self._remove_raw_files()
+
+    def _remove_raw_files(self) -> None:
+        for path in (self.raw_ids_path, self.raw_features_path):
+            if path.exists():
+                path.unlink()
+
+
+class FeatureStore:
+    """
+    Columnar, memory-mapped storage of the sample features, one file per dataset.
+
+    The json encoded `Sample.features` are convenient for single samples, but parsing them for every sample is far
+    too slow whenever the complete feature matrix is needed (e.g. by the active learning worker). Therefore, the
+    features are additionally written as float32 `.npy` file at import time and memory-mapped on read.
+    Datasets that were imported before the store existed are converted on first access.
+    """
+    data_path = DATA_PATH / 'features'
+
+    def __init__(self):
+        raise ValueError("FeatureStore should not be instantiated.")
+
+    @staticmethod
+    def _paths(dataset_id: int):
+        return (FeatureStore.data_path / f'{dataset_id}.ids.npy',
+                FeatureStore.data_path / f'{dataset_id}.features.npy')
+
+    @staticmethod
+    def csv_path(dataset_id: int):
+        """ The features of a dataset as they were imported (csv without labels) """
+        return FeatureStore.data_path / f'{dataset_id}.features.csv'
+
+    @staticmethod
+    def exists(dataset_id: int) -> bool:
+        return all(path.exists() for path in FeatureStore._paths(dataset_id))
+
+    @staticmethod
+    def write(dataset_id: int, sample_ids: Iterable[int], features: np.ndarray) -> None:
+        """ Persist the feature matrix of a dataset. `features[i]` has to belong to `sample_ids[i]` """
+        sample_ids = np.asarray(list(sample_ids), dtype=np.int64)
+        features = np.asarray(features, dtype=np.float32)
+        if len(sample_ids) != len(features):
+            raise ValueError("There has to be exactly one feature row for each sample")
+        order = np.argsort(sample_ids, kind='stable')
+
+        FeatureStore.data_path.mkdir(parents=True, exist_ok=True)
+        for path, array in zip(FeatureStore._paths(dataset_id), (sample_ids[order], features[order])):
+            # write to a temporary file first, readers should never see a half written matrix
+            tmp_path = path.with_suffix('.tmp')
+            with tmp_path.open('wb') as file:
+                np.save(file, array)
+            tmp_path.replace(path)
+
+    @staticmethod
+    def writer(dataset_id: int, number_of_features: int) -> FeatureStoreWriter:
+        return FeatureStoreWriter(dataset_id, number_of_features)
+
+    @staticmethod
+    def load(dataset_id: int) -> FeatureMatrix:
+        """ Memory-map the features of a dataset, building the store from the database if necessary """
+        if not FeatureStore.exists(dataset_id):
+            FeatureStore.rebuild(dataset_id)
+        ids_path, features_path = FeatureStore._paths(dataset_id)
+        return FeatureMatrix(ids=np.load(ids_path), matrix=np.load(features_path, mmap_mode='r'))
+
+    @staticmethod
+    def rebuild(dataset_id: int) -> None:
+        logger.info(f"Building feature store for dataset {dataset_id}")
+        rows = db.query(Sample.id, Sample.features).filter(Sample.dataset_id == dataset_id).order_by(Sample.id).all()
+        sample_ids: List[int] = [sample_id for sample_id, _ in rows]
+        features = [list(json.loads(json_features).values()) for _, json_features in rows]
+        FeatureStore.write(dataset_id, sample_ids, np.array(features, dtype=np.float32))
+
+    @staticmethod
+    def import_legacy_csv(dataset_id: int, features_csv: str, sample_ids: List[int]) -> None:
+        """
+        Store the features csv of a dataset imported before the store existed (formerly `Dataset.features`).
+
+        The csv is kept as `csv_path`. Its rows are in import order, i.e. the order of the sample ids. If the number
+        of rows does not match, the store is built from `Sample.features` instead.
+        """
+        FeatureStore.data_path.mkdir(parents=True, exist_ok=True)
+        FeatureStore.csv_path(dataset_id).write_text(features_csv)
+        features = pd.read_csv(StringIO(features_csv)).drop(columns="ID")
+        if len(features.index) != len(sample_ids):
+            logger.warning(f"Features csv of dataset {dataset_id} does not match its samples, using the samples")
+            FeatureStore.rebuild(dataset_id)
+            return
+        FeatureStore.write(dataset_id, sorted(sample_ids), features.to_numpy(dtype=np.float32))
+
+    @staticmethod
+    def migrate_dataset_features() -> None:
+        """
+        Move the features csv of all datasets from the legacy `dataset.features` column into the store and drop the
+        column afterwards. `create_all` does not alter tables, therefore this has to run at startup.
+        """
+        columns = [column['name'] for column in inspect(db.get_bind()).get_columns('dataset')]
+        if 'features' not in columns:
+            return
+        dataset_ids = [dataset_id for dataset_id, in db.execute(
+            text("SELECT id FROM dataset WHERE features IS NOT NULL ORDER BY id"))]
+        for dataset_id in dataset_ids:  # one csv at a time, they can be large
+            logger.info(f"Moving the features of dataset {dataset_id} into the feature store")
+            features_csv = db.execute(text("SELECT features FROM dataset WHERE id = :id"), {'id': dataset_id}).scalar()
+            sample_ids = [sample_id for sample_id, in db.query(Sample.id).filter(Sample.dataset_id == dataset_id)]
+            FeatureStore.import_legacy_csv(dataset_id, features_csv, sample_ids)
+        # only dropped once all features were moved, an interrupted migration continues on the next start
+        db.execute(text("ALTER TABLE dataset DROP COLUMN features"))
+        db.commit()
+
+    @staticmethod
+    def delete(dataset_id: int) -> None:
+        for path in (*FeatureStore._paths(dataset_id), FeatureStore.csv_path(dataset_id)):
+            if path.exists():
+                path.unlink()
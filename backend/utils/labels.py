@@ -1,8 +1,10 @@
+from typing import Dict
+
 from fastapi import Depends
 from sqlalchemy.orm import Session
 
 from ..config import db
-from ..models import Dataset, Label, Sample
+from ..models import Dataset, Label, Sample, Association
 
 
 def can_assign(sample_id: int, label_id: int):
@@ -15,3 +17,16 @@ def can_assign(sample_id: int, label_id: int):
         .filter(Label.id == label_id)
         .count()
     )
+
+
+def first_label_per_sample(dataset_id: int) -> Dict[int, str]:
+    """ SampleID -> name of the first label of every labeled sample of the dataset, fetched in a single query """
+    rows = db.query(Association.sample_id, Label.name) \
+        .join(Label, Association.label_id == Label.id) \
+        .filter(Label.dataset_id == dataset_id) \
+        .order_by(Association.sample_id) \
+        .all()
+    labels: Dict[int, str] = {}
+    for sample_id, label_name in rows:
+        labels.setdefault(sample_id, label_name)
+    return labels
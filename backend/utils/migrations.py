@@ -0,0 +1,30 @@
+from sqlalchemy import inspect, text
+
+from ..config import db, logger, BlobStore
+
+# number of images moved into the blob store per transaction
+IMAGE_MIGRATION_BATCH_SIZE = 500
+
+
+def migrate_image_contents() -> None:
+    """
+    Move the image data of the legacy `image.content` column into the `BlobStore` and drop the column afterwards.
+    Runs at startup after `create_all`, which adds the `content_hash` column to existing tables.
+    """
+    columns = [column['name'] for column in inspect(db.get_bind()).get_columns('image')]
+    if 'content' not in columns:
+        return
+    logger.info("Moving image contents into the blob store")
+    while True:
+        rows = db.execute(text(
+            "SELECT id, content FROM image WHERE content IS NOT NULL AND content_hash IS NULL ORDER BY id LIMIT :limit"
+        ), {'limit': IMAGE_MIGRATION_BATCH_SIZE}).all()
+        if not rows:
+            break
+        db.execute(text("UPDATE image SET content_hash = :content_hash WHERE id = :id"), [
+            {'id': image_id, 'content_hash': BlobStore.put(bytes(content))} for image_id, content in rows
+        ])
+        db.commit()
+    # only dropped once all contents were moved, an interrupted migration continues on the next start
+    db.execute(text("ALTER TABLE image DROP COLUMN content"))
+    db.commit()
@@ -0,0 +1,48 @@
+import re
+from typing import List, Optional
+
+from sqlalchemy import func
+
+from ..models import SEARCH_CONFIGURATION
+
+# quoted phrase or single term, a leading '-' negates it
+SEARCH_TERM = re.compile(r'(-?)(?:"([^"]*)"|(\S+))')
+WORD = re.compile(r'\w+')
+
+
+def parse_search_query(free_text: str) -> Optional[str]:
+    """
+    Translates a search string into the `to_tsquery` syntax, `None` if it contains no words.
+
+    Supported are multiple words (all have to match), `"quoted phrases"`, prefixes (`tab*`), negation (`-word`) and
+    `OR` between terms. Everything else is treated as separator, so the input can never be an invalid tsquery.
+
+    >>> parse_search_query('"machine learning" tab* -image OR picture')
+    'machine <-> learning & tab:* & !image | picture'
+    """
+    terms: List[str] = []
+    operator = ' & '
+    for negated, phrase, word in SEARCH_TERM.findall(free_text):
+        if word == 'OR' and not negated:
+            if terms:
+                operator = ' | '
+            continue
+        words = WORD.findall(phrase if phrase else word)
+        if not words:
+            continue
+        term = ' <-> '.join(words)
+        if not phrase and word.endswith('*'):
+            term += ':*'
+        if negated:
+            term = '!' + term if len(words) == 1 else '!({})'.format(term)
+        if terms:
+            terms.append(operator)
+        terms.append(term)
+        operator = ' & '
+    return ''.join(terms) or None
+
+
+def search_query(free_text: str):
+    """ tsquery expression for the search string, `None` if it contains no words """
+    query = parse_search_query(free_text)
+    return func.to_tsquery(SEARCH_CONFIGURATION, query) if query else None
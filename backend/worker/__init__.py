@@ -5,4 +5,5 @@ from .manager import manager
 from ..config import logger, db
 from ..models import Dataset, Sample
 from ..utils import number_of_labelled_samples
-from .alWorker import AlWorker
\ No newline at end of file
+from .alWorker import AlWorker
+from .snapshot import WorkerSnapshot
@@ -1,20 +1,113 @@
+import asyncio
+import itertools
+import os
 import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
 from multiprocessing.connection import Pipe
-from typing import Set
+from typing import Deque, Dict, Optional, Set, List, Iterable
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_, exists
 
 from ..config import logger, db
-from .process import ActiveLearningProcess, SampleID, EventType
-from ..models import Dataset
+from .process import ActiveLearningProcess, SampleID, LabelID, EventType
+from ..models import Sample, Association, ActiveLearningConfig
+
+# seconds a request waits for a suggestion of the AL process before a random sample is used
+SUGGESTION_TIMEOUT = 2.0
+# seconds a thread waits for the event loop to unregister the pipe of a stopped process
+REMOVE_READER_TIMEOUT = 5.0
+
+
+@dataclass
+class SampleLease:
+    """ Reservation of a suggested sample for one user, other users do not get the sample until it expires """
+    user_id: int
+    expires_at: float
+
+    def expired(self, now: float) -> bool:
+        return self.expires_at <= now
+
+
+class UnlabeledSamplePool:
+    """ Ids of the samples without current label, with O(1) insertion, removal and random choice """
+
+    def __init__(self, sample_ids: Iterable[SampleID] = ()):
+        self.sample_ids: List[SampleID] = []
+        self.positions: Dict[SampleID, int] = {}
+        for sample_id in sample_ids:
+            self.add(sample_id)
+
+    @staticmethod
+    def load(dataset_id: int) -> 'UnlabeledSamplePool':
+        """ Anti-join against the current associations, backed by the partial index on them """
+        has_current_label = exists().where(and_(Association.sample_id == Sample.id, Association.is_current))
+        rows = db.query(Sample.id).filter(Sample.dataset_id == dataset_id).filter(~has_current_label)
+        return UnlabeledSamplePool(sample_id for sample_id, in rows)
+
+    def __len__(self):
+        return len(self.sample_ids)
+
+    def add(self, sample_id: SampleID) -> None:
+        if sample_id not in self.positions:
+            self.positions[sample_id] = len(self.sample_ids)
+            self.sample_ids.append(sample_id)
+
+    def discard(self, sample_id: SampleID) -> None:
+        position = self.positions.pop(sample_id, None)
+        if position is None:
+            return
+        # move the last id into the gap instead of shifting the list
+        last = self.sample_ids.pop()
+        if last != sample_id:
+            self.sample_ids[position] = last
+            self.positions[last] = position
+
+    def choice(self, excluded: Set[SampleID] = frozenset(), attempts: int = 32) -> Optional[SampleID]:
+        """ Random id that is not excluded, `None` if no such id was found """
+        if len(self.sample_ids) <= len(excluded):  # few candidates left, do not rely on luck
+            candidates = [sample_id for sample_id in self.sample_ids if sample_id not in excluded]
+            return random.choice(candidates) if candidates else None
+        for _ in range(attempts):
+            sample_id = random.choice(self.sample_ids)
+            if sample_id not in excluded:
+                return sample_id
+        return None
 
 
 class AlWorker:
+    """
+    Backend side of an `ActiveLearningProcess`.
+
+    Requests for new samples carry a request id. The responses are read by a reader registered at the asyncio event
+    loop (`loop.add_reader` on the pipe), which resolves the future waiting for that request id. Therefore, awaiting
+    the next sample does neither block the event loop nor a thread of the threadpool.
 
-    def __init__(self, dataset_id: int):
+    The suggestions are kept in a ranked buffer of `SUGGESTION_BUFFER_SIZE` samples, which is refilled in the
+    background as soon as it drops to `SUGGESTION_LOW_WATER_MARK`. Every handed out sample is leased to the
+    requesting user for `SUGGESTION_LEASE_SECONDS`, so concurrent annotators never get the same sample.
+    """
+
+    def __init__(self, dataset_id: int, config: ActiveLearningConfig):
         self.dataset_id = dataset_id
+        self.config = config
+        self.requested_sample_ids: Deque[SampleID] = deque()  # ranked, best suggestion first
+        self.suggested_sample_ids: Dict[SampleID, SampleLease] = {}
+        self.leased_sample_of_user: Dict[int, SampleID] = {}  # user id -> sample id, the inverse of the leases
+        # labeled through this worker, responses computed before the process got the label must not suggest them
+        self.labeled_sample_ids: Set[SampleID] = set()
+        self.unlabeled_pool: Optional[UnlabeledSamplePool] = None  # loaded on the first random fallback
+        self._pool_lock = threading.Lock()
+        self.pending_request_id: Optional[int] = None
+        self.response_futures: Dict[int, asyncio.Future] = {}
+        self._request_ids = itertools.count()
+        self._send_lock = threading.Lock()  # sends can happen from the event loop and threadpool threads
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.last_used = time.monotonic()
         self._create_process()
-        self.requested_sample_ids: Set[SampleID] = set()
-        self.suggested_sample_ids: Set[SampleID] = set()
-        self.pending_request = False
         self.start_process()
 
     def _create_process(self):
@@ -28,81 +121,270 @@ class AlWorker:
         self.process.start()
         self._request_samples_proactive()
 
-    def stop_process(self):
+    def stop_process(self, wait: bool = True):
+        """ Stop the process, which snapshots its state. Without `wait`, it is joined in a background thread """
         if self.process.is_alive():
-            self.pipe_endpoint.send({
+            self._remove_reader()
+            self._send({
                 'event': EventType.STOP
             })
-            self.process.join(None)
-            self.pipe_endpoint.close()
-            self.process.close()
+            if wait:
+                self._join()
+            else:
+                threading.Thread(target=self._join, daemon=True).start()
+
+    def _join(self):
+        self.process.join(None)
+        self.pipe_endpoint.close()
+        self.process.close()
 
-    def restart_process(self):
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_used
+
+    def resident_memory(self) -> int:
+        """ Resident set size of the process in bytes, 0 if it is unknown (not running or no procfs) """
+        try:
+            with open(f'/proc/{self.process.pid}/statm') as statm:
+                resident_pages = int(statm.read().split()[1])
+            return resident_pages * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return 0
+
+    def restart_process(self, config: Optional[ActiveLearningConfig] = None):
         self.stop_process()
+        if config is not None:
+            self.config = config
+        self.pending_request_id = None
+        self.requested_sample_ids.clear()  # the ranking of the old process is meaningless for the new one
         self._create_process()
         self.start_process()
 
     def __del__(self):
-        try:  # __del__ could be called before __init__ is finished
+        try:  # __del__ could be called before __init__ is finished or after the process was stopped
             self.process.join()
             self.process.close()
-        except AttributeError:
+        except (AttributeError, ValueError):
             pass
 
-    def get_next_sample_id(self) -> SampleID:
-        if len(self.requested_sample_ids) != 0:
-            logger.info("Suggested sample according to QueryStrategy")
-            sample_id: SampleID = self.requested_sample_ids.pop()
-        else:
-            self.requested_sample_ids.update(self.recv_else_random())
-            sample_id = self.requested_sample_ids.pop()
-        # request more samples now to prevent random samples
-        if len(self.requested_sample_ids) < 2:
-            self._request_samples_proactive()
+    def _send(self, message: Dict) -> None:
+        with self._send_lock:
+            self.pipe_endpoint.send(message)
 
-        self.suggested_sample_ids.add(sample_id)
-        return sample_id
+    def _ensure_reader(self) -> None:
+        """ Register the pipe at the running event loop, responses are then handled by `_on_response` """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._remove_reader()
+            loop.add_reader(self.pipe_endpoint.fileno(), self._on_response)
+            self._loop = loop
 
-    def recv_else_random(self) -> Set[SampleID]:
-        assert self.process.is_alive()
-        # if pipe is empty send new request
-        if self.pipe_endpoint.poll():
+    def _remove_reader(self) -> None:
+        """ Unregister the pipe. The event loop is not thread-safe, from other threads this waits for the loop """
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            on_loop_thread = asyncio.get_running_loop() is loop
+        except RuntimeError:  # no running loop in this thread, e.g. a threadpool thread
+            on_loop_thread = False
+        if on_loop_thread:
+            self._detach_reader(loop)
+            return
+        detached = threading.Event()
+
+        def detach():
+            try:
+                self._detach_reader(loop)
+            finally:
+                detached.set()
+
+        try:
+            loop.call_soon_threadsafe(detach)
+        except RuntimeError:  # loop already closed, nothing is registered anymore
+            self._loop = None
+            return
+        # wait, so that the reader is gone before the pipe is closed and its file descriptor reused
+        detached.wait(timeout=REMOVE_READER_TIMEOUT)
+
+    def _detach_reader(self, loop: asyncio.AbstractEventLoop) -> None:
+        """ Has to be called in the thread of the event loop """
+        if self._loop is not loop:
+            return
+        try:
+            loop.remove_reader(self.pipe_endpoint.fileno())
+        except (OSError, ValueError, RuntimeError):  # pipe or loop already closed
+            pass
+        for future in self.response_futures.values():
+            future.cancel()
+        self.response_futures = {}
+        self._loop = None
+
+    def _on_response(self) -> None:
+        while self.pipe_endpoint.poll():
             message = self.pipe_endpoint.recv()
-            if message['event'] == EventType.REQUEST:
-                self.pending_request = False
-                return set(message['sample_ids'])
-            else:
+            if message['event'] != EventType.REQUEST:
                 raise RuntimeError(f"Event type ({message['event']}) could not be handled")
+
+            request_id = message['request_id']
+            if request_id == self.pending_request_id:
+                self.pending_request_id = None
+            # late responses are still useful for the next requests
+            self._merge_suggestions(message['sample_ids'])
+            future = self.response_futures.pop(request_id, None)
+            if future is not None and not future.done():
+                future.set_result(message['sample_ids'])
+
+    def _merge_suggestions(self, sample_ids) -> None:
+        """ The newest ranking comes first, older suggestions that were not ranked again are kept behind it """
+        ranked = [sample_id for sample_id in dict.fromkeys(sample_ids)
+                  if sample_id not in self.suggested_sample_ids and sample_id not in self.labeled_sample_ids]
+        known = set(ranked)
+        ranked.extend(sample_id for sample_id in self.requested_sample_ids if sample_id not in known)
+        self.requested_sample_ids = deque(ranked[:max(self.config.SUGGESTION_BUFFER_SIZE, len(sample_ids))])
+
+    def _release_expired_leases(self) -> None:
+        now = time.monotonic()
+        expired = [sample_id for sample_id, lease in self.suggested_sample_ids.items() if lease.expired(now)]
+        for sample_id in expired:
+            self._release(sample_id)
+
+    def _lease(self, sample_id: SampleID, user_id: int) -> None:
+        previous = self.leased_sample_of_user.get(user_id)
+        if previous is not None and previous != sample_id:
+            self._release(previous)
+        self.suggested_sample_ids[sample_id] = SampleLease(
+            user_id=user_id, expires_at=time.monotonic() + self.config.SUGGESTION_LEASE_SECONDS)
+        self.leased_sample_of_user[user_id] = sample_id
+
+    def _release(self, sample_id: SampleID) -> bool:
+        """ Remove the lease of the sample, False if it was not leased """
+        lease = self.suggested_sample_ids.pop(sample_id, None)
+        if lease is None:
+            return False
+        if self.leased_sample_of_user.get(lease.user_id) == sample_id:
+            del self.leased_sample_of_user[lease.user_id]
+        return True
+
+    def _leased_sample_of(self, user_id: int) -> Optional[SampleID]:
+        return self.leased_sample_of_user.get(user_id)
+
+    def _pop_suggestion(self) -> Optional[SampleID]:
+        while self.requested_sample_ids:
+            sample_id = self.requested_sample_ids.popleft()
+            if sample_id not in self.suggested_sample_ids:
+                return sample_id
+        return None
+
+    async def get_next_sample_id(self, user_id: int) -> SampleID:
+        """
+        Next sample for the given user: the sample still leased to the user (e.g. after reloading the page), else the
+        best ranked suggestion that is not leased to anybody else.
+        """
+        self._ensure_reader()
+        self.last_used = time.monotonic()
+        self._release_expired_leases()
+
+        sample_id = self._leased_sample_of(user_id)
+        if sample_id is None:
+            sample_id = self._pop_suggestion()
+            if sample_id is None:
+                await self._wait_for_suggestions()
+                sample_id = self._pop_suggestion()
+
+            if sample_id is not None:
+                logger.info("Suggested sample according to QueryStrategy")
+            else:
+                sample_id = await self._random_unleased_sample_id()
+            self._lease(sample_id, user_id)
         else:
-            # wait for response
-            logger.info("Suggested random sample")
-            # use random sample if nothing received TODO improve db access time
-            samples = db.get(Dataset, self.dataset_id).samples
-            unlabeled_ids = list(map(lambda sample: sample.id, filter(lambda sample: sample.labels == [], samples)))
-            return {random.choice(unlabeled_ids)}
+            self._lease(sample_id, user_id)  # renew
+
+        # refill in the background, so the following requests can be answered from the buffer
+        if len(self.requested_sample_ids) <= self.config.SUGGESTION_LOW_WATER_MARK and self._is_running():
+            self._request_samples_proactive()
+        return sample_id
+
+    def _is_running(self) -> bool:
+        """ False after the worker was stopped, e.g. evicted while a request was waiting """
+        try:
+            return self.process.is_alive()
+        except ValueError:  # process already closed
+            return False
+
+    async def _wait_for_suggestions(self) -> None:
+        if not self._is_running():
+            return
+        self._request_samples_proactive()
+        future = self.response_futures.get(self.pending_request_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.response_futures[self.pending_request_id] = future
+        try:
+            # shield: a timed out request stays pending and fills requested_sample_ids later
+            await asyncio.wait_for(asyncio.shield(future), timeout=SUGGESTION_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # the response future is cancelled when the process is restarted or stopped, the caller falls back to a
+            # random sample then. The cancellation of the request itself is passed on.
+            if not future.cancelled():
+                raise
+
+    async def _random_unleased_sample_id(self, attempts: int = 3) -> SampleID:
+        """ Random unlabeled sample that is not leased, the leases are only read in the thread of the event loop """
+        sample_id = None
+        for _ in range(attempts):
+            leased = set(self.suggested_sample_ids)
+            # run_in_threadpool keeps the context, i.e. the database session of the request
+            sample_id = await run_in_threadpool(self.random_unlabeled_sample_id, leased)
+            if sample_id not in self.suggested_sample_ids:  # might have been leased while waiting for the thread
+                break
+        return sample_id
+
+    def random_unlabeled_sample_id(self, excluded: Set[SampleID] = frozenset()) -> SampleID:
+        logger.info("Suggested random sample")
+        with self._pool_lock:
+            if self.unlabeled_pool is None:
+                self.unlabeled_pool = UnlabeledSamplePool.load(self.dataset_id)
+            sample_id = self.unlabeled_pool.choice(excluded=excluded)
+        if sample_id is None:
+            raise IndexError("No unlabeled sample left")
+        return sample_id
 
     def _request_samples_proactive(self) -> None:
         assert self.process.is_alive()
-        logger.debug("Sending sample request")
-        if not self.pending_request:  # only request if not already done
-            self.pipe_endpoint.send({
+        if self.pending_request_id is None:  # only request if not already done
+            logger.debug("Sending sample request")
+            self.pending_request_id = next(self._request_ids)
+            self._send({
                 'event': EventType.REQUEST,
+                'request_id': self.pending_request_id,
+                'size': max(1, self.config.SUGGESTION_BUFFER_SIZE - len(self.requested_sample_ids)),
             })
-            self.pending_request = True
 
-    def add_sample_label(self, sample_id: SampleID) -> None:
-        if sample_id in self.suggested_sample_ids:
-            self.suggested_sample_ids.remove(sample_id)
-        else:
+    def add_sample_label(self, sample_id: SampleID, label_id: LabelID) -> None:
+        self.last_used = time.monotonic()
+        if not self._release(sample_id):
             logger.warning("Sample was never suggested")
+        if sample_id in self.requested_sample_ids:
+            self.requested_sample_ids.remove(sample_id)
+        self.labeled_sample_ids.add(sample_id)
+        with self._pool_lock:
+            if self.unlabeled_pool is not None:
+                self.unlabeled_pool.discard(sample_id)
 
-        self.pipe_endpoint.send({
+        self._send({
             'event': EventType.ADD,
-            'sample_id': sample_id
+            'sample_id': sample_id,
+            'label_id': label_id
         })
 
     def remove_sample_label(self, sample_id: SampleID) -> None:
-        self.pipe_endpoint.send({
+        self.labeled_sample_ids.discard(sample_id)
+        with self._pool_lock:
+            if self.unlabeled_pool is not None:
+                self.unlabeled_pool.add(sample_id)
+        self._send({
             'event': EventType.REMOVE,
             'sample_id': sample_id
         })
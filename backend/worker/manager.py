@@ -1,15 +1,24 @@
-import time
+import asyncio
+from collections import OrderedDict
 from typing import Dict, Optional
 
-from ..models import Dataset
+from ..config import logger, MAX_AL_WORKERS, MAX_AL_WORKER_MEMORY_MB, AL_WORKER_CHECK_INTERVAL
+from ..models import Dataset, ActiveLearningConfig
 from .alWorker import AlWorker
 
 
 class ProcessManager:
     """
     Class for management of active-learning process for different data sets.
+
+    At most `MAX_AL_WORKERS` processes run at the same time, each holding the feature matrix of its dataset. The
+    workers are kept in least recently used order: if the pool is full, or the processes use more than
+    `MAX_AL_WORKER_MEMORY_MB`, the least recently used worker is stopped. Workers that were not used for
+    `TIMEOUT_FOR_WORKER` minutes are stopped as well. A stopped worker snapshots its model and resumes from it when
+    its dataset is used again.
     """
-    workers: Dict[int, AlWorker] = {}
+    workers: 'OrderedDict[int, AlWorker]' = OrderedDict()
+    _supervisor: Optional[asyncio.Task] = None
 
     def get_or_else_load(self, dataset: Dataset) -> AlWorker:
         """
@@ -23,17 +32,60 @@ class ProcessManager:
         :return:            Process resources as a dictionary with the fields: 'process' and 'pipe'
         """
         if dataset.id in self.workers:
+            self.workers.move_to_end(dataset.id)
             return self.workers[dataset.id]
         else:
-            return self.create_worker(dataset.id)
+            return self.create_worker(dataset.id, dataset.get_config())
 
     def get(self, dataset: Dataset) -> Optional[AlWorker]:
         return self.workers.get(dataset.id)
 
-    def create_worker(self, dataset_id: int) -> AlWorker:
-        worker = AlWorker(dataset_id)
+    def create_worker(self, dataset_id: int, config: ActiveLearningConfig) -> AlWorker:
+        while len(self.workers) >= MAX_AL_WORKERS:
+            self.evict(next(iter(self.workers)))
+        worker = AlWorker(dataset_id, config)
         self.workers[dataset_id] = worker
         return worker
 
+    def evict(self, dataset_id: int, wait: bool = False) -> None:
+        """ Stop the worker of the dataset, with `wait` until it has written its snapshot """
+        worker = self.workers.pop(dataset_id, None)
+        if worker is not None:
+            logger.info(f"Stopping AL worker of dataset {dataset_id}")
+            worker.stop_process(wait=wait)
+
+    def memory_usage(self) -> Dict[int, int]:
+        """ Resident memory in bytes per dataset id """
+        return {dataset_id: worker.resident_memory() for dataset_id, worker in self.workers.items()}
+
+    def evict_idle_workers(self) -> None:
+        for dataset_id, worker in list(self.workers.items()):
+            if worker.idle_seconds() > worker.config.TIMEOUT_FOR_WORKER * 60:
+                self.evict(dataset_id)
+
+    def enforce_memory_limit(self) -> None:
+        if MAX_AL_WORKER_MEMORY_MB <= 0:
+            return
+        usage = self.memory_usage()
+        # the most recently used worker is kept in any case
+        while len(self.workers) > 1 and sum(usage.values()) > MAX_AL_WORKER_MEMORY_MB * 2 ** 20:
+            dataset_id = next(iter(self.workers))
+            usage.pop(dataset_id)
+            self.evict(dataset_id)
+
+    async def _supervise(self) -> None:
+        while True:
+            await asyncio.sleep(AL_WORKER_CHECK_INTERVAL)
+            try:
+                self.evict_idle_workers()
+                self.enforce_memory_limit()
+            except Exception as e:
+                logger.error(e)
+
+    def start_supervision(self) -> None:
+        """ Periodically stop idle workers and enforce the memory limit, has to be called in the running event loop """
+        if self._supervisor is None:
+            self._supervisor = asyncio.get_running_loop().create_task(self._supervise())
+
 
 manager = ProcessManager()
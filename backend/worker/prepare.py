@@ -1,4 +1,3 @@
-from io import StringIO
 from typing import Tuple, Dict
 
 import numpy as np
@@ -7,6 +6,7 @@ from pandas import DataFrame
 
 from ..config import db
 from ..models import Association, Sample, Dataset
+from ..utils import FeatureStore
 from .etiTypes import *
 
 
@@ -19,8 +19,7 @@ def prepare_dataset_for_active_learning(dataset: Dataset) -> Tuple[DataFrame, Di
     - a column label with the labels already assigned
     - remaining columns are features
     """
-    buffer = StringIO(dataset.features)
-    sample_df = pd.read_csv(buffer).drop("ID", "columns")  # We could use "ID" as an index but it is not guaranteed to be 0-based
+    sample_df = pd.read_csv(FeatureStore.csv_path(dataset.id)).drop("ID", "columns")  # We could use "ID" as an index but it is not guaranteed to be 0-based
 
     all_sample_ids = db.query(Sample.id).filter(Sample.dataset_id == dataset.id).all()
     all_sample_ids = np.array(all_sample_ids)[:, 0]
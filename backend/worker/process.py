@@ -1,17 +1,22 @@
 import multiprocessing
-import random
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Deque, Tuple
+
 import numpy as np
 from enum import Enum
 from multiprocessing.connection import Connection
-from typing import List, Tuple
 
 from alipy import metrics
 from alipy.index import IndexCollection
 
 from .etiTypes import *
 from ..config import db, logger
-from ..models import Dataset, Sample, QueryStrategyAbstraction, ActiveLearningConfig
+from ..models import Dataset, Sample, Association, QueryStrategyAbstraction, ActiveLearningConfig
+from ..utils import FeatureStore, FeatureMatrix
+from .snapshot import WorkerSnapshot
 
 
 class EventType(Enum):
@@ -21,15 +26,14 @@ class EventType(Enum):
     STOP = 3,
 
 
-def split_by_pred(pred: callable, list: List) -> Tuple[List, List]:
-    l1 = []
-    l2 = []
-    for item in list:
-        if pred(item):
-            l1.append(item)
-        else:
-            l2.append(item)
-    return l1, l2
+# marks unlabeled samples in the label vector, label ids are always positive
+NO_LABEL = -1
+# number of estimators added to ensemble models per incremental update
+WARM_START_ESTIMATORS = 10
+# maximum number of estimators added by warm starts, the next update is a full refit instead
+MAX_WARM_START_ESTIMATORS = 50
+# minimum number of seconds between two snapshots written after a training
+SNAPSHOT_INTERVAL = 300
 
 
 class ActiveLearningProcess(multiprocessing.Process):
@@ -51,39 +55,64 @@ class ActiveLearningProcess(multiprocessing.Process):
     def _prepare(self):
         dataset: Dataset = db.get(Dataset, self.dataset_id)
         self.config = dataset.get_config()
-        # split samples
-        unlabeled, labeled = split_by_pred(lambda smpl: smpl.labels == [], dataset.samples)
-
-        # TODO use configuration
-        nbr_of_samples = len(dataset.samples)
-        nbr_of_features = len(dataset.feature_names.split(","))
-
-        self.idx_sample_map = {}
-        self.sample_idx_map = {}
-        complete_feature_matrix = np.empty((nbr_of_samples, nbr_of_features))  # empty 2d array
-        for idx, sample in enumerate(dataset.samples):
-            complete_feature_matrix[idx] = sample.extract_feature_list()
-            self.idx_sample_map[idx] = sample.id
-            self.sample_idx_map[sample.id] = idx
-
-        # assuming dataset is single labeled
-        label_list = np.empty(shape=nbr_of_samples, dtype=str)
-        for lab_sample in labeled:
-            label_list[self.sample_idx_map[lab_sample.id]] = lab_sample.labels[0].name
-        # create index collection and query
-        self.unlabeled_idx = IndexCollection([self.sample_idx_map[sample.id] for sample in unlabeled])
-        self.labeled_idx = IndexCollection([self.sample_idx_map[sample.id] for sample in labeled])
-        self.query_strategy = QueryStrategyAbstraction.build(qs_type=self.config.QUERY_STRATEGY,
-                                                               X=complete_feature_matrix,
-                                                               y=label_list,
-                                                               config=self.config.QUERY_STRATEGY_CONFIG,)
-        model_class = self.config.AL_MODEL.get_class()
-        self.model = model_class()
+
+        # zero-copy view on the memory-mapped feature store, row = internal index
+        self.features: FeatureMatrix = FeatureStore.load(self.dataset_id)
+        self.idx_sample_map = {idx: int(sample_id) for idx, sample_id in enumerate(self.features.ids)}
+        self.sample_idx_map = self.features.row_index
+
+        self.model = self.config.AL_MODEL.get_class()()
+        # internal indices labeled since the last fit, used for incremental training
+        self.newly_labeled_idx: List[InternalSampleID] = []
+        self.incremental_updates = 0
+        self.full_refit_required = True
         self.batch_size = self.config.BATCH_SIZE
         self.counter_until_next_eval = self.config.COUNTER_UNTIL_NEXT_EVAL
         self.counter_until_next_update = self.config.COUNTER_UNTIL_NEXT_MODEL_UPDATE
         self.evaluation_size = 30  # number of samples used to measure prediction
 
+        # Training and querying run in a single background thread, so that the event loop can keep answering
+        # requests from the precomputed suggestions. The lock guards the label state, the suggestions and the pipe.
+        self.lock = threading.RLock()
+        self.trainer = ThreadPoolExecutor(max_workers=1)
+        self.training_scheduled = False
+        self.refill_scheduled = False
+        self.stopping = False  # set on STOP, queued trainings and refills are skipped then
+        self.suggestions: Deque[SampleID] = deque()
+        # (request id, number of requested samples) of requests that could not be answered yet
+        self.pending_requests: Deque[Tuple[int, int]] = deque()
+        # number of ranked samples queried per refill
+        self.suggestion_depth = max(self.batch_size, self.config.SUGGESTION_BUFFER_SIZE)
+        self.last_snapshot = time.monotonic()
+
+    def _load_label_state(self):
+        """ The label state is only read once, afterwards it is kept up to date by the ADD / REMOVE events """
+        # assuming dataset is single labeled: label id per internal index, NO_LABEL for unlabeled samples
+        self.labels = np.full(shape=len(self.features), fill_value=NO_LABEL, dtype=np.int64)
+        current_associations = db.query(Association.sample_id, Association.label_id) \
+            .join(Association.sample) \
+            .filter(Sample.dataset_id == self.dataset_id) \
+            .filter(Association.is_current) \
+            .all()
+        for sample_id, label_id in current_associations:
+            self.labels[self.sample_idx_map[sample_id]] = label_id
+        self.labeled_mask = self.labels != NO_LABEL
+
+        # create index collection and query
+        self.unlabeled_idx = IndexCollection(np.flatnonzero(~self.labeled_mask).tolist())
+        self.labeled_idx = IndexCollection(np.flatnonzero(self.labeled_mask).tolist())
+        self.query_strategy = QueryStrategyAbstraction.build(qs_type=self.config.QUERY_STRATEGY,
+                                                               X=self.features.matrix,
+                                                               y=self.labels,
+                                                               config=self.config.QUERY_STRATEGY_CONFIG,)
+
+    def _count_current_associations(self) -> int:
+        return db.query(Association) \
+            .join(Association.sample) \
+            .filter(Sample.dataset_id == self.dataset_id) \
+            .filter(Association.is_current) \
+            .count()
+
     def run(self):
         """
         This methods represents the entry point to the active-learning code.
@@ -94,7 +123,9 @@ class ActiveLearningProcess(multiprocessing.Process):
         """
         print(f'Running process for dataset {self.dataset_id}')
         self._prepare()
-        self._update_model(bypass_counter=True)
+        if not self._restore_snapshot():
+            self._load_label_state()
+            self._update_model(bypass_counter=True)
         self._wait_for_events()
 
     def _wait_for_events(self):
@@ -118,34 +149,123 @@ class ActiveLearningProcess(multiprocessing.Process):
             print(f"workerID: {self.dataset_id} Received event{event_type}")
 
             if event_type == EventType.ADD:
-                self.add_label(sample_id=message['sample_id'])
+                self.add_label(sample_id=message['sample_id'], label_id=message['label_id'])
 
             elif event_type == EventType.REMOVE:
                 self.remove_label(sample_id=message['sample_id'])
 
             elif event_type == EventType.REQUEST:
-                print(f"WorkerID: {self.dataset_id} sending response")
-                assert not self.pipe_endpoint.closed
-                assert self.pipe_endpoint.writable
-                self.pipe_endpoint.send({
-                    'event': EventType.REQUEST,
-                    'sample_ids': self._request_next_sample(),
-                })
+                with self.lock:
+                    self.pending_requests.append((message['request_id'], message.get('size', self.batch_size)))
+                    self._answer_pending_requests()
+                    if not self.suggestions:
+                        self._schedule_refill()
+
             elif event_type == EventType.STOP:
                 break
 
+        # shutdown(cancel_futures=True) needs Python 3.9, the queued tasks return immediately instead
+        with self.lock:
+            self.stopping = True
+        self.trainer.shutdown(wait=True)
+        self._save_snapshot()
         exit()
 
-    def add_label(self, sample_id: SampleID):
+    def _save_snapshot(self):
+        """ Write the fitted model together with the label state it belongs to, see `_restore_snapshot` """
+        if not hasattr(self.model, 'classes_'):  # nothing fitted yet, nothing worth saving
+            return
+        # counted before the lock is taken, label events must not wait for the database query
+        association_count = self._count_current_associations()
+        with self.lock:
+            state = {
+                'sample_ids': np.asarray(self.features.ids),
+                'labels': self.labels.copy(),
+                'labeled_idx': list(self.labeled_idx.index),
+                'unlabeled_idx': list(self.unlabeled_idx.index),
+                'query_strategy': self.query_strategy,
+                'model': self.model,
+                'incremental_updates': self.incremental_updates,
+                'newly_labeled_idx': list(self.newly_labeled_idx),
+                'full_refit_required': self.full_refit_required,
+                'suggestions': list(self.suggestions),
+                'association_count': association_count,
+            }
+            self.last_snapshot = time.monotonic()
+        try:
+            WorkerSnapshot.save(self.dataset_id, self.config, state, features=self.features.matrix)
+        except Exception as e:
+            logger.error(f"Could not save snapshot of worker {self.dataset_id}: {e}")
+
+    def _restore_snapshot(self) -> bool:
+        """
+        Continue from the last snapshot if it was written for the same config and samples. If the number of current
+        associations still matches, the complete state is restored without touching the labels in the database.
+        Otherwise, the label state is rebuilt and the old model is retrained with the current labels in the
+        background. Returns False, if the worker has to be prepared from scratch.
+        """
+        state = WorkerSnapshot.load(self.dataset_id, self.config, features=self.features.matrix)
+        if state is None or not np.array_equal(state['sample_ids'], self.features.ids):
+            return False
+
+        self.model = state['model']
+        self.incremental_updates = state['incremental_updates']
+
+        if state['association_count'] == self._count_current_associations():
+            print(f"WorkerID: {self.dataset_id} resuming from snapshot")
+            self.labels = state['labels']
+            self.labeled_mask = self.labels != NO_LABEL
+            self.labeled_idx = IndexCollection(state['labeled_idx'])
+            self.unlabeled_idx = IndexCollection(state['unlabeled_idx'])
+            self.query_strategy = state['query_strategy']
+            self.newly_labeled_idx = state['newly_labeled_idx']
+            self.full_refit_required = state['full_refit_required']
+            self.suggestions = deque(state['suggestions'])
+            return True
+
+        # labels changed while the worker was stopped: train with the current labels in the background
+        print(f"WorkerID: {self.dataset_id} resuming model from snapshot, labels changed")
+        self._load_label_state()
+        old_labels = state['labels']
+        removed = (old_labels != NO_LABEL) & (old_labels != self.labels)
+        self.full_refit_required = bool(removed.any())
+        self.newly_labeled_idx = np.flatnonzero((old_labels == NO_LABEL) & self.labeled_mask).tolist()
+        self._schedule_training()
+        return True
+
+    def _answer_pending_requests(self):
+        """ Answer waiting requests with the precomputed suggestions. Has to be called with the lock held """
+        while self.pending_requests and self.suggestions:
+            request_id, size = self.pending_requests.popleft()
+            sample_ids = []
+            while self.suggestions and len(sample_ids) < size:
+                sample_ids.append(self.suggestions.popleft())
+            print(f"WorkerID: {self.dataset_id} sending response")
+            self.pipe_endpoint.send({
+                'event': EventType.REQUEST,
+                'request_id': request_id,
+                'sample_ids': sample_ids,
+            })
+
+    def add_label(self, sample_id: SampleID, label_id: LabelID):
         idx = self.sample_idx_map[sample_id]
-        self.labeled_idx.update(idx)
-        self.unlabeled_idx.difference_update(idx)
+        with self.lock:
+            self.labels[idx] = label_id
+            self.labeled_mask[idx] = True
+            self.labeled_idx.update(idx)
+            self.unlabeled_idx.difference_update(idx)
+            self.newly_labeled_idx.append(idx)
         self._update_model()
 
-    def remove_label(self, sample_id: int) -> None:
+    def remove_label(self, sample_id: SampleID) -> None:
         idx = self.sample_idx_map[sample_id]
-        self.labeled_idx.difference_update(idx)
-        self.unlabeled_idx.update(idx)
+        with self.lock:
+            self.labels[idx] = NO_LABEL
+            self.labeled_mask[idx] = False
+            self.labeled_idx.difference_update(idx)
+            self.unlabeled_idx.update(idx)
+            # a removed label can not be unlearned incrementally
+            self.full_refit_required = True
         self._update_model(measure=False)
 
     def _update_model(self, measure=True, bypass_counter=False):
@@ -156,44 +276,142 @@ class ActiveLearningProcess(multiprocessing.Process):
             # reset counter and update model
             self.counter_until_next_update = self.batch_size
         if measure:
-            self._measure_model()
+            self._schedule_training()
+
+    def _schedule_training(self):
+        with self.lock:
+            if self.training_scheduled:
+                return
+            self.training_scheduled = True
+        self.trainer.submit(self._train)
+
+    def _schedule_refill(self):
+        with self.lock:
+            if self.refill_scheduled or self.training_scheduled:  # training refills the suggestions anyway
+                return
+            self.refill_scheduled = True
+        self.trainer.submit(self._refill_suggestions)
+
+    def _train(self):
+        """ Runs in the background thread: fit the model on a snapshot of the label state, then refill """
+        with self.lock:
+            self.training_scheduled = False
+            if self.stopping:
+                return
+            labeled = np.flatnonzero(self.labeled_mask)
+            y = self.labels[labeled]
+            new_idx = [idx for idx in self.newly_labeled_idx if self.labeled_mask[idx]]
+            self.newly_labeled_idx = []
+            full_refit, self.full_refit_required = self.full_refit_required, False
+        if not self._measure_model(labeled, y, new_idx, full_refit):
+            # nothing (successfully) fitted, the next training still has to refit from scratch
+            with self.lock:
+                self.full_refit_required = self.full_refit_required or full_refit or not hasattr(self.model, 'classes_')
+        self._refill_suggestions()
+        if time.monotonic() - self.last_snapshot > SNAPSHOT_INTERVAL:
+            self._save_snapshot()
 
-    def _measure_model(self):
+    def _measure_model(self, labeled: np.ndarray, y: np.ndarray, new_idx: List[InternalSampleID],
+                       full_refit: bool) -> bool:
+        """ Returns False, if the model could not be fitted """
         print("Starting model training")
-        dataset: Dataset = db.query(Dataset).get(self.dataset_id)
-        labeled_samples: List[Sample] = list(filter(lambda smpl: smpl.labels != [], dataset.samples))
-
-        # extract features from json
-        X = []  # feature_matrix: 2d list
-        y = []  # label_list: 1d list
-        for sample in labeled_samples:
-            X.append(sample.extract_feature_list())
-            y.append(sample.labels[0].name)  # assuming dataset is single-labeled
+        if len(labeled) == 0:
+            return False
+
         start = time.time()
         try:
-            self.model.fit(X, y)
+            self._fit(labeled, y, new_idx, full_refit)
         except Exception as e:
             logger.error(e)
-            return
+            with self.lock:
+                self.full_refit_required = True
+            return False
         finally:
             stop = time.time()
             print(f"Training phase took: {round(stop - start, 3)}s")
 
         # reset counter and measure accuracy
-        rand_test_sample_list: List[Sample] = [random.choice(labeled_samples) for _ in range(30)]
-        label = [sample.labels[0].name for sample in rand_test_sample_list]
-        predictions = self.model.predict([sample.extract_feature_list() for sample in rand_test_sample_list])
-        accuracy = metrics.accuracy_score(predictions, label)
-        labeled_percentage = len(labeled_samples) / len(dataset.samples)
+        rand_test = np.random.choice(len(labeled), size=self.evaluation_size)
+        predictions = self.model.predict(self.features.matrix[labeled[rand_test]])
+        accuracy = metrics.accuracy_score(predictions, y[rand_test])
+        labeled_percentage = len(labeled) / len(self.labels)
         # TODO save prediction history
         print(f"prediction accuracy: {round(accuracy * 100, 2)}%,"
               f" with {round(labeled_percentage * 100, 2)}% labeled dataset")
+        return True
+
+    def _fit(self, labeled: np.ndarray, y: np.ndarray, new_idx: List[InternalSampleID], full_refit: bool):
+        """
+        Fit the model on all labeled samples or, if INCREMENTAL_TRAINING is enabled and the model supports it, update
+        it incrementally. Models with `partial_fit` are updated with the samples labeled since the last fit only.
+        Warm started models are fitted on all labeled samples, but reuse the previous solution: ensembles only fit
+        WARM_START_ESTIMATORS additional estimators (up to MAX_WARM_START_ESTIMATORS in total), other models start
+        the optimisation from the last coefficients. Every FULL_REFIT_EVERY updates (or whenever a label was removed,
+        an unknown class appeared or the ensemble is full) the model is refitted from scratch.
+        """
+        al_model = self.config.AL_MODEL
+        y_new = y[np.searchsorted(labeled, new_idx)]  # labeled is sorted and contains all new_idx
+
+        incremental = self.config.INCREMENTAL_TRAINING \
+            and not full_refit \
+            and hasattr(self.model, 'classes_') \
+            and self.incremental_updates < self.config.FULL_REFIT_EVERY \
+            and (al_model.supports_partial_fit() or al_model.supports_warm_start()) \
+            and set(y_new).issubset(self.model.classes_) \
+            and (al_model.supports_partial_fit() or self._can_add_estimators())
+
+        if not incremental:
+            model = al_model.get_class()()
+            if al_model.supports_warm_start():
+                model.set_params(warm_start=self.config.INCREMENTAL_TRAINING)
+            model.fit(self.features.matrix[labeled], y)
+            self.model = model
+            self.incremental_updates = 0
+            return
+
+        if len(new_idx) == 0:
+            return
+        print(f"Incremental update with {len(new_idx)} new samples")
+        if al_model.supports_partial_fit():
+            self.model.partial_fit(self.features.matrix[new_idx], y_new)
+        else:
+            if 'n_estimators' in self.model.get_params():
+                self.model.set_params(n_estimators=self.model.n_estimators + WARM_START_ESTIMATORS)
+            self.model.fit(self.features.matrix[labeled], y)
+        self.incremental_updates += 1
+
+    def _can_add_estimators(self) -> bool:
+        """ Whether a warm start stays within MAX_WARM_START_ESTIMATORS, always true for models without estimators """
+        params = self.model.get_params()
+        if 'n_estimators' not in params:
+            return True
+        initial_estimators = self.config.AL_MODEL.get_class()().get_params()['n_estimators']
+        return params['n_estimators'] + WARM_START_ESTIMATORS <= initial_estimators + MAX_WARM_START_ESTIMATORS
+
+    def _refill_suggestions(self):
+        """ Runs in the background thread: query the next samples and answer all waiting requests """
+        with self.lock:
+            self.refill_scheduled = False
+            if self.stopping:
+                return
+            labeled_idx = IndexCollection(self.labeled_idx.index)
+            unlabeled_idx = IndexCollection(self.unlabeled_idx.index)
+        try:
+            selected_sample_ids = self._request_next_sample(labeled_idx, unlabeled_idx)
+        except Exception as e:
+            logger.error(e)
+            return
+        with self.lock:
+            # samples might have been labeled while querying
+            self.suggestions = deque(sample_id for sample_id in selected_sample_ids
+                                     if not self.labeled_mask[self.sample_idx_map[sample_id]])
+            self._answer_pending_requests()
 
-    def _request_next_sample(self) -> List[int]:
+    def _request_next_sample(self, labeled_idx: IndexCollection, unlabeled_idx: IndexCollection) -> List[int]:
 
-        selected_id_list: List = self.query_strategy.select(label_index=self.labeled_idx,
-                                                            unlabel_index=self.unlabeled_idx,
-                                                            model=self.model, batch_size=self.batch_size)
+        selected_id_list: List = self.query_strategy.select(label_index=labeled_idx,
+                                                            unlabel_index=unlabeled_idx,
+                                                            model=self.model, batch_size=self.suggestion_depth)
         # only work with ids to reduce db-access times
         selected_sample_ids: List[int] = [self.idx_sample_map[sel_id] for sel_id in selected_id_list]
         return selected_sample_ids
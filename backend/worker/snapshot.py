@@ -0,0 +1,95 @@
+import hashlib
+import pickle
+from typing import Dict, Optional
+
+import numpy as np
+
+from ..config import logger, DATA_PATH
+from ..models import ActiveLearningConfig
+
+# increased whenever the content of the snapshots changes, older snapshots are ignored then
+SNAPSHOT_VERSION = 1
+FEATURES_REFERENCE = 'features'
+
+
+class _SnapshotPickler(pickle.Pickler):
+    """ Stores references instead of copies of the (memory-mapped) feature matrix, e.g. inside query strategies """
+
+    def __init__(self, file, features: np.ndarray):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.features = features
+
+    def persistent_id(self, obj):
+        if isinstance(obj, np.ndarray) and obj.shape == self.features.shape \
+                and np.may_share_memory(obj, self.features):
+            return FEATURES_REFERENCE
+        return None
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, file, features: np.ndarray):
+        super().__init__(file)
+        self.features = features
+
+    def persistent_load(self, pid):
+        if pid != FEATURES_REFERENCE:
+            raise pickle.UnpicklingError(f"Unknown reference {pid}")
+        return self.features
+
+
+class WorkerSnapshot:
+    """
+    On-disk state of an `ActiveLearningProcess`, one file per dataset.
+
+    A running worker writes its fitted model, label state and query strategy periodically and when it is stopped,
+    the next start continues from it instead of repeating the preparation and the initial fit. A snapshot starts with
+    a header of the format version and the hash of the config it was written with, snapshots that do not match
+    are ignored.
+    """
+    data_path = DATA_PATH / 'workers'
+
+    def __init__(self):
+        raise ValueError("WorkerSnapshot should not be instantiated.")
+
+    @staticmethod
+    def _path(dataset_id: int):
+        return WorkerSnapshot.data_path / f'{dataset_id}.pickle'
+
+    @staticmethod
+    def _header(config: ActiveLearningConfig) -> Dict:
+        return {
+            'version': SNAPSHOT_VERSION,
+            'config_hash': hashlib.sha256(config.json().encode()).hexdigest(),
+        }
+
+    @staticmethod
+    def save(dataset_id: int, config: ActiveLearningConfig, state: Dict, features: np.ndarray) -> None:
+        WorkerSnapshot.data_path.mkdir(parents=True, exist_ok=True)
+        path = WorkerSnapshot._path(dataset_id)
+        tmp_path = path.with_suffix('.tmp')
+        with tmp_path.open('wb') as file:
+            pickle.dump(WorkerSnapshot._header(config), file)
+            _SnapshotPickler(file, features).dump(state)
+        tmp_path.replace(path)
+
+    @staticmethod
+    def load(dataset_id: int, config: ActiveLearningConfig, features: np.ndarray) -> Optional[Dict]:
+        """ The state of the last snapshot, `None` if there is none or it was written for another version / config """
+        path = WorkerSnapshot._path(dataset_id)
+        if not path.exists():
+            return None
+        try:
+            with path.open('rb') as file:
+                if pickle.load(file) != WorkerSnapshot._header(config):
+                    logger.info(f"Ignoring outdated snapshot of worker {dataset_id}")
+                    return None
+                return _SnapshotUnpickler(file, features).load()
+        except Exception as e:  # a broken snapshot only costs a full rebuild
+            logger.warning(f"Could not load snapshot of worker {dataset_id}: {e}")
+            return None
+
+    @staticmethod
+    def delete(dataset_id: int) -> None:
+        path = WorkerSnapshot._path(dataset_id)
+        if path.exists():
+            path.unlink()
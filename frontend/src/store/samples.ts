@@ -7,6 +7,14 @@ export type Sample = {
   content: any
 }
 
+// sample lists only contain a link to the content of each sample
+export type ListedSample = {
+  id: number
+  type: string
+  content_url: string
+  content?: any
+}
+
 export const samples_to_label = writable<Sample[] | null>([])
 
 export async function loadSample(dataset_id): Promise<Sample> {
@@ -35,3 +43,21 @@ export async function getSpecificSample(sample_id) {
   })
   return d
 }
+
+// content of a listed sample as the labeling components expect it: text, images base64 encoded
+export async function loadContent(sample: ListedSample): Promise<string> {
+  const { data } = await axios({
+    method: 'get',
+    url: sample.content_url,
+    responseType: sample.type === 'image' ? 'arraybuffer' : 'text',
+  })
+  if (sample.type !== 'image') {
+    return data
+  }
+  let binary = ''
+  const bytes = new Uint8Array(data)
+  for (let i = 0; i < bytes.length; i++) {
+    binary += String.fromCharCode(bytes[i])
+  }
+  return btoa(binary)
+}